@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Union
+from codons import CodonCounter, QualityModel
+from fastq import list_fastq
+from incremental import CountCache, count_incremental
+from metrics import RunMetrics
+from probes import ProbeIndex
+from scanner import Hit, ProbeScanner
+from sharding import count_sharded
+
+
+class CodonCount(NamedTuple):
+    """Codon found after a probe row, with its quality-filtered and raw counts in the sample."""
+    gen: str
+    gen_position: str
+    probe: str
+    position: int
+    codon: str
+    reference: str
+    start: int
+    read: str
+    count: int
+    raw: int
+
+
+def count_codons(index: ProbeIndex, files: Sequence[str], metrics: Optional[RunMetrics] = None,
+                 paired: bool = False, dedup: bool = False, workers: Optional[int] = 1,
+                 cache: Optional[CountCache] = None, scanner: Optional[ProbeScanner] = None,
+                 quality: QualityModel = QualityModel()) -> CodonCounter:
+    """Count the codons of every probe row of the index in the fastq files of a sample. The files
+    are read once and all the probes matched at the same time; with a cache only the probe rows
+    missing there are scanned, and with several workers the files are split in record-aligned
+    shards scanned in parallel.
+
+    Args:
+        index (ProbeIndex): Compiled probe index.
+        files (Sequence[str]): Fastq and fastq.gz files of the sample.
+        metrics (RunMetrics): Metrics of the run.
+        paired (bool): Read the mates of the paired-end runs together, counting each fragment once per probe.
+        dedup (bool): Count once the fragments with the same sequences.
+        workers (int): Worker processes scanning the shards of the fastq files, all the CPUs if None.
+        cache (CountCache): Cache of the codon counts, none by default.
+        scanner (ProbeScanner): Scanner of the index, reused between samples, built from the index if None.
+        quality (QualityModel): Phred's quality filter of the codons, its offset is detected from the files if not set.
+
+    Returns:
+        (CodonCounter): Codon counter of all the probe rows of the index.
+    """
+    quality = quality.resolve(files)
+    if metrics is not None:
+        metrics.set('phred_offset', quality.offset)
+    if cache is not None:
+        return count_incremental(index, files, cache, metrics, paired, dedup, workers, quality)
+    if workers != 1:
+        if paired or dedup:
+            raise ValueError('The fastq files are split in shards only for single-end reads without dedup')
+        return count_sharded(list(index.targets()), index.mismatches, files, workers, metrics, quality=quality)
+    scanner = scanner if scanner is not None else ProbeScanner.from_index(index)
+    counter = CodonCounter(index.targets(), quality=quality)
+    hits: Iterator[Hit] = scanner.scan(files, metrics, paired, dedup)
+    if metrics is not None:
+        # The matching stage includes the decompression and prefilter stages nested in it, the rest is codon calling.
+        hits = metrics.timed('matching', hits, counter=None)
+    return counter.update(hits)
+
+
+def analyze(fastq_paths: Union[str, Sequence[str]], probes: Union[str, ProbeIndex] = 'forward.csv',
+            reference_file: str = 'Probes_MTB.csv', mismatches: int = 1, metrics: Optional[RunMetrics] = None,
+            paired: bool = False, dedup: bool = False, workers: Optional[int] = 1,
+            incremental: bool = False, quality: QualityModel = QualityModel()) -> List[CodonCount]:
+    """Count the codons found after every probe in the fastq files of a sample. It needs neither
+    pandas nor the GUI once the probe index is cached, so it is cheap to import from a pipeline
+    or a worker process.
+
+    Args:
+        fastq_paths (Union[str, Sequence[str]]): Folders with fastq and fastq.gz files, or the files themselves.
+        probes (Union[str, ProbeIndex]): Filename of the csv with probes and position to search, or a compiled probe index.
+        reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+        mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+        metrics (RunMetrics): Metrics of the run.
+        paired (bool): Read the _1 and _2 mates of the paired-end runs together, counting each fragment once per probe.
+        dedup (bool): Count once the fragments with the same sequences (PCR duplicates).
+        workers (int): Worker processes scanning record-aligned shards of the fastq files, all the CPUs if None.
+        incremental (bool): Reuse the cached codon counts of the sample, scanning only the new or edited probes.
+        quality (QualityModel): Phred's quality filter of the codons, its offset is detected from the files if not set.
+
+    Returns:
+        (List[CodonCount]): Codons found after each probe row, in probe row order.
+    """
+    paths: Sequence[str] = [fastq_paths] if isinstance(fastq_paths, str) else fastq_paths
+    files: List[str] = [file for path in paths for file in list_fastq(path)]
+    index: ProbeIndex = (probes if isinstance(probes, ProbeIndex)
+                         else ProbeIndex.cached(probes, reference_file, mismatches))
+    counter: CodonCounter = count_codons(index, files, metrics, paired, dedup, workers,
+                                         CountCache() if incremental else None, quality=quality)
+
+    counts: List[CodonCount] = []
+    for row, probe, position in index.targets():
+        gen, gen_position, reference = (index.genes[row].decode(), index.gen_positions[row].decode(),
+                                        index.references[row].decode())
+        for codon, start, read, count, raw in counter.results(row) or []:
+            counts.append(CodonCount(gen, gen_position, probe, position, codon, reference, start, read, count, raw))
+    return counts
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+from time import time
+from typing import Dict, IO, Iterator, List, NamedTuple, Set, Tuple
+import numpy as np
+import pandas as pd
+from Liponium import heteroresistence
+from analysis import count_codons
+from codons import CodonCounter
+from metrics import RunMetrics
+from probes import REFERENCE_POSITION, ProbeIndex
+from reports import get_writers
+from scanner import ProbeScanner, reverse_complement
+
+NUCLEOTIDES: np.ndarray = np.frombuffer(b'ACGT', dtype=np.uint8)
+HIGH_QUALITY: str = 'I'
+LOW_QUALITY: str = '+'
+
+
+LocusKey = Tuple[str, int]
+
+
+class Locus(NamedTuple):
+    """Synthetic genome context of a probe, with the offset of the codon of each of its loci."""
+    probe: str
+    template: str
+    start: int
+    codons: List[Tuple[LocusKey, int, str]]
+
+
+def random_sequence(rng: np.random.Generator, length: int) -> str:
+    """Random nucleotide sequence.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        length (int): Length of the sequence.
+
+    Returns:
+        (str): Nucleotide sequence.
+    """
+    return NUCLEOTIDES[rng.integers(0, 4, length)].tobytes().decode()
+
+
+def build_loci(index: ProbeIndex, read_length: int, rng: np.random.Generator) -> List[Locus]:
+    """Build a synthetic context for each probe: random flanks, the probe, and the reference codon of
+    its Gen-Position at the offset of the reference position; the other codon positions, that may
+    overlap it, keep the random flank. Each locus, a Gen-Position and codon position, gets a mutated
+    codon to be planted in the reads.
+
+    Args:
+        index (ProbeIndex): Compiled probe index.
+        read_length (int): Length of the reads.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        (List[Locus]): Context, probe start, and locus, codon offset, and mutated codon of each locus of the probe.
+    """
+    loci: List[Locus] = []
+    for number, probe in enumerate(np.char.decode(index.probes).tolist()):
+        rows: np.ndarray = np.flatnonzero(index.row_probes == number)
+        start: int = read_length
+        tail: int = int(index.positions[rows].max()) + 2 + read_length
+        template: List[str] = list(random_sequence(rng, start) + probe + random_sequence(rng, tail))
+        for row in rows:
+            offset: int = start + len(probe) + int(index.positions[row]) - 1
+            reference: str = index.references[row].decode()
+            if (int(index.positions[row]) == REFERENCE_POSITION and len(reference) == 3
+                    and set(reference) <= set('ACGT')):
+                template[offset:offset + 3] = reference
+        codons: List[Tuple[LocusKey, int, str]] = []
+        for row in rows:
+            offset = start + len(probe) + int(index.positions[row]) - 1
+            mutated: str = random_sequence(rng, 3)
+            while mutated == ''.join(template[offset:offset + 3]):
+                mutated = random_sequence(rng, 3)
+            codons.append(((index.gen_positions[row].decode(), int(index.positions[row])), offset, mutated))
+        loci.append(Locus(probe, ''.join(template), start, codons))
+    return loci
+
+
+def target_reads(loci: List[Locus], depth: int, read_length: int, frequency: float, error_rate: float,
+                 rng: np.random.Generator, truth: Dict[Tuple[str, int, str], int],
+                 mismatches: int = 1) -> Iterator[Tuple[str, str]]:
+    """Sample the reads covering the probes, planting the mutated codons and the sequencing errors,
+    and half of them from the reverse strand. The planted codon of each covered locus is added to truth,
+    unless the read can not be counted: a sequencing error hits the codon, or more errors than the
+    allowed mismatches hit the probe.
+
+    Args:
+        loci (List[Locus]): Synthetic contexts of the probes.
+        depth (int): Reads covering each probe.
+        read_length (int): Length of the reads.
+        frequency (float): Fraction of the molecules carrying the mutated codon of each locus.
+        error_rate (float): Probability of a sequencing error at each base, errors get a low Phred's quality.
+        rng (np.random.Generator): Random generator.
+        truth (Dict[Tuple[str, int, str], int]): Planted counts of each Gen-Position, position, and codon,
+                                                 updated in place.
+        mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+
+    Returns:
+        (Iterator[Tuple[str, str]]): Sequence and Phred's quality of each read.
+    """
+    for _ in range(depth):
+        for locus in loci:
+            molecule: List[str] = list(locus.template)
+            for _, offset, mutated in locus.codons:
+                if rng.random() < frequency:
+                    molecule[offset:offset + 3] = mutated
+
+            begin: int = locus.start - int(rng.integers(0, read_length - len(locus.probe) + 1))
+            errors: np.ndarray = rng.random(read_length) < error_rate
+            found: bool = errors[locus.start - begin:locus.start - begin + len(locus.probe)].sum() <= mismatches
+            for key, offset, _ in locus.codons:
+                # The codons with a sequencing error get a low quality, the quality filter leaves them out.
+                if (found and begin <= offset and offset + 3 <= begin + read_length
+                        and not errors[offset - begin:offset - begin + 3].any()):
+                    codon: Tuple[str, int, str] = (*key, ''.join(molecule[offset:offset + 3]))
+                    truth[codon] = truth.get(codon, 0) + 1
+
+            read: np.ndarray = np.frombuffer(''.join(molecule[begin:begin + read_length]).encode(), dtype=np.uint8).copy()
+            read[errors] = NUCLEOTIDES[(np.searchsorted(NUCLEOTIDES, read[errors]) + rng.integers(1, 4, errors.sum())) % 4]
+            quality: str = ''.join(np.where(errors, LOW_QUALITY, HIGH_QUALITY))
+            sequence: str = read.tobytes().decode()
+            if rng.random() < 0.5:
+                yield reverse_complement(sequence), quality[::-1]
+            else:
+                yield sequence, quality
+
+
+def ambiguous_loci(index: ProbeIndex, loci: List[Locus]) -> Set[LocusKey]:
+    """Loci whose probe is also found in the context of another probe, their reads at that
+    context are counted too, so their planted frequencies can not be checked.
+
+    Args:
+        index (ProbeIndex): Compiled probe index.
+        loci (List[Locus]): Synthetic contexts of the probes.
+
+    Returns:
+        (Set[LocusKey]): Gen-Position and position of the ambiguous loci.
+    """
+    scanner: ProbeScanner = ProbeScanner.from_index(index)
+    probes: Set[int] = set()
+    for number, locus in enumerate(loci):
+        probes.update(scanner.strands[found][0] for found in scanner.locate(locus.template.encode()))
+        probes.discard(number)
+    rows: np.ndarray = np.flatnonzero(np.isin(index.row_probes, list(probes)))
+    return {(index.gen_positions[row].decode(), int(index.positions[row])) for row in rows}
+
+
+def write_sample(path: str, index: ProbeIndex, depth: int = 100, read_length: int = 150, frequency: float = 0.1,
+                 error_rate: float = 0.0, background: int = 10000, seed: int = 1) -> Dict[Tuple[str, int, str], int]:
+    """Write a synthetic fastq (or fastq.gz) file with reads at the probe loci mixed with off-target reads.
+
+    Args:
+        path (str): Path of the fastq file, compressed when it ends with .gz.
+        index (ProbeIndex): Compiled probe index.
+        depth (int): Reads covering each probe.
+        read_length (int): Length of the reads.
+        frequency (float): Fraction of the molecules carrying the mutated codon of each row.
+        error_rate (float): Probability of a sequencing error at each base.
+        background (int): Number of off-target reads.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        (Dict[Tuple[str, int, str], int]): Planted counts of each Gen-Position, position, and codon, but the
+                                           ambiguous loci.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    loci: List[Locus] = build_loci(index, read_length, rng)
+    truth: Dict[Tuple[str, int, str], int] = {}
+    targets: Iterator[Tuple[str, str]] = target_reads(loci, depth, read_length, frequency, error_rate, rng, truth,
+                                                      index.mismatches)
+
+    remaining_targets: int = depth * len(loci)
+    remaining: int = remaining_targets + background
+    handle: IO[str] = gzip.open(path, 'wt', compresslevel=1) if path.endswith('.gz') else open(path, 'w')
+    with handle:
+        for number in range(remaining):
+            if rng.random() < remaining_targets / (remaining - number):
+                sequence, quality = next(targets)
+                remaining_targets -= 1
+            else:
+                sequence, quality = random_sequence(rng, read_length), HIGH_QUALITY * read_length
+            handle.write(f'@SYN{number}.1 {number} length={read_length}\n{sequence}\n+\n{quality}\n')
+
+    ambiguous: Set[LocusKey] = ambiguous_loci(index, loci)
+    return {key: count for key, count in truth.items() if key[:2] not in ambiguous}
+
+
+def locus_frequencies(counts: Dict[Tuple[str, int, str], float]) -> pd.Series:
+    """Frequency of each codon within its locus, a Gen-Position and codon position, like the reports.
+
+    Args:
+        counts (Dict[Tuple[str, int, str], float]): Counts of each Gen-Position, position, and codon.
+
+    Returns:
+        (pd.Series): Frequency of each Gen-Position, position, and codon, in percent.
+    """
+    series: pd.Series = pd.Series(counts, dtype=float)
+    if series.empty:
+        return series
+    return series * 100 / series.groupby(level=[0, 1]).transform('sum')
+
+
+def run_benchmark(files: List[str], index: ProbeIndex, truth: Dict[Tuple[str, int, str], int], output: str,
+                  app: heteroresistence) -> Dict[str, float]:
+    """Time each stage of the pipeline over the fastq files and compare the recovered frequencies
+    with the planted ones. The codons are counted by analysis.count_codons, with the quality model
+    detected from the files, and its RunMetrics split the time in decompression, prefilter, probe
+    matching, and codon calling; the table is built by the aminoacids_frequencies of the reports.
+
+    Args:
+        files (List[str]): Fastq files of the synthetic sample.
+        index (ProbeIndex): Compiled probe index.
+        truth (Dict[Tuple[str, int, str], int]): Planted counts of each Gen-Position, position, and codon.
+        output (str): Folder of the reports.
+        app (heteroresistence): Report builder of the probes and reference of the index.
+
+    Returns:
+        (Dict[str, float]): Seconds of each stage, reads scanned, and largest frequency error.
+    """
+    results: Dict[str, float] = {}
+
+    start = time()
+    metrics: RunMetrics = RunMetrics('benchmark')
+    counter: CodonCounter = count_codons(index, files, metrics)
+    counting: float = time() - start
+    stages: Dict[str, float] = {stage: span['seconds'] for stage, span in metrics.stages.items()}
+    results['decompress'] = stages.get('decompression', 0.0)
+    results['prefilter'] = stages.get('prefilter', 0.0)
+    results['match'] = stages.get('matching', 0.0) - results['decompress'] - results['prefilter']
+    results['codon calling'] = counting - stages.get('matching', 0.0)
+
+    start = time()
+    table: pd.DataFrame = app.aminoacids_frequencies(index, counter)
+    results['aggregation'] = time() - start
+
+    start = time()
+    for writer in get_writers(['csv'], output):
+        writer.write('Unmerged_Report', table)
+    results['reporting'] = time() - start
+
+    expected: pd.Series = locus_frequencies(truth)
+    recovered: pd.Series = (table.assign(Locus=np.asarray(index.positions)[counter.columns()['Row']])
+                            .groupby(['Genes', 'Locus', 'Mutated Codon'])['Frequencies'].sum())
+    if len(expected):
+        recovered = recovered[recovered.index.droplevel(2).isin(expected.index.droplevel(2))]
+    both: pd.DataFrame = pd.concat([expected.rename('expected'), recovered.rename('recovered')], axis=1).fillna(0)
+    results['reads'] = metrics.counters['reads']
+    results['hits'] = metrics.counters['hits']
+    results['rejection rate'] = metrics.summary()['rejection_rate']
+    results['loci checked'] = expected.groupby(level=[0, 1]).ngroups if len(expected) else 0
+    results['max frequency error'] = float((both['expected'] - both['recovered']).abs().max()) if len(both) else 0.0
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Liponium benchmark over a synthetic sample with planted codons.')
+    parser.add_argument('--depth', type=int, default=100, help='Reads covering each probe')
+    parser.add_argument('--read-length', type=int, default=150, help='Length of the reads')
+    parser.add_argument('--frequency', type=float, default=0.1, help='Fraction of reads with the mutated codons')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Sequencing error probability per base')
+    parser.add_argument('--background', type=int, default=100000, help='Number of off-target reads')
+    parser.add_argument('--gzip', action='store_true', help='Write the synthetic sample compressed')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random generator')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='Largest frequency error accepted, in percent')
+    parser.add_argument('--probes', default='forward.csv', help='Csv with probes and position to search')
+    parser.add_argument('--reference', default='Probes_MTB.csv', help='Csv with the reference codons')
+    args = parser.parse_args()
+
+    probe_index: ProbeIndex = ProbeIndex.cached(args.probes, args.reference)
+    with tempfile.TemporaryDirectory() as folder:
+        sample: str = os.path.join(folder, 'synthetic.fastq' + ('.gz' if args.gzip else ''))
+        start = time()
+        planted = write_sample(sample, probe_index, args.depth, args.read_length, args.frequency,
+                               args.error_rate, args.background, args.seed)
+        print(f'Time to generate the synthetic sample:  {time() - start} seconds')
+        benchmark: Dict[str, float] = run_benchmark([sample], probe_index, planted, os.path.join(folder, 'Reports'),
+                                                    heteroresistence(args.reference, args.probes))
+
+    for stage in ('decompress', 'prefilter', 'match', 'codon calling', 'aggregation', 'reporting'):
+        print(f'{stage:>14}:  {benchmark[stage]:.4f} seconds')
+    scanning: float = benchmark['decompress'] + benchmark['prefilter'] + benchmark['match']
+    print(f'Reads scanned:  {benchmark["reads"]:.0f}  ({benchmark["reads"] / scanning:.0f} reads per second, '
+          f'{benchmark["rejection rate"]:.1%} rejected by the k-mer filter)')
+    print(f'Largest frequency error:  {benchmark["max frequency error"]:.4f} % '
+          f'over {benchmark["loci checked"]:.0f} loci')
+    sys.exit(0 if benchmark['max frequency error'] <= args.tolerance else 1)
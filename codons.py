@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Hashable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from fastq import phred_offset
+from scanner import Hit
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Standard genetic code (NCBI table 1) with the codons in TCAG order.
+GENETIC_CODE: Dict[str, str] = dict(zip((first + second + third for first in 'TCAG' for second in 'TCAG' for third in 'TCAG'),
+                                        'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'))
+
+
+def translation_table() -> np.ndarray:
+    """Build the 5x5x5 translation table indexed by the codes of the bases A, C, G, T, and N.
+    A codon with N translates to the aminoacid shared by all the codons it could be, or X.
+
+    Returns:
+        (np.ndarray): Aminoacid of each codon, as a flat array of 125 entries.
+    """
+    table: List[str] = []
+    for first in 'ACGTN':
+        for second in 'ACGTN':
+            for third in 'ACGTN':
+                aminoacids = {GENETIC_CODE[a + b + c] for a in first.replace('N', 'ACGT')
+                              for b in second.replace('N', 'ACGT') for c in third.replace('N', 'ACGT')}
+                table.append(aminoacids.pop() if len(aminoacids) == 1 else 'X')
+    return np.array(table)
+
+
+AMINOACIDS: np.ndarray = translation_table()
+BASE_CODES: np.ndarray = np.full(256, 4, dtype=np.int64)
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = code
+
+# Columns of the codon count matrix: the 64 codons in ACGT order, and one for the codons with any other base.
+CODONS: np.ndarray = np.array([first + second + third for first in 'ACGT' for second in 'ACGT' for third in 'ACGT']
+                              + ['NNN'])
+OTHER_CODON: int = 64
+CODON_CODES: Dict[str, int] = {codon: code for code, codon in enumerate(CODONS[:OTHER_CODON])}
+
+
+def translate_codons(codons: pd.Series) -> np.ndarray:
+    """Translate a whole column of codons to aminoacids with the array-indexed genetic code.
+    Only the first 3 nucleotides are translated, shorter or missing codons translate to an empty string.
+
+    Args:
+        codons (pd.Series): Codons to translate.
+
+    Returns:
+        (np.ndarray): Aminoacid of each codon.
+    """
+    values: np.ndarray = np.char.encode(codons.fillna('').astype(str).to_numpy(dtype='U3'), 'ascii')
+    if not len(values):
+        return np.empty(0, dtype='U1')
+    bases: np.ndarray = BASE_CODES[values.astype('S3').view(np.uint8).reshape(len(values), 3)]
+    aminoacids: np.ndarray = AMINOACIDS[bases[:, 0] * 25 + bases[:, 1] * 5 + bases[:, 2]]
+    return np.where(np.char.str_len(values) == 3, aminoacids, '')
+
+
+class QualityModel(NamedTuple):
+    """Phred's quality filter of the codon calling: each base of a codon needs a quality of at least
+    min_phred and, optionally, its read a mean quality of at least mean_phred. The offset of the
+    quality characters (33 or 64) is detected from the fastq files when it is None.
+    """
+    min_phred: int = 30
+    mean_phred: Optional[float] = None
+    offset: Optional[int] = None
+
+    def resolve(self, files: Sequence[str]) -> 'QualityModel':
+        """Fix the offset of the quality characters, detecting it from the fastq files if it is not set.
+
+        Args:
+            files (Sequence[str]): Fastq and fastq.gz files of the sample.
+
+        Returns:
+            (QualityModel): Quality model with the offset set.
+        """
+        return self if self.offset is not None else self._replace(offset=phred_offset(files))
+
+
+    def key(self) -> str:
+        """Key of the quality model, for the caches and result stores of the codon counts.
+
+        Returns:
+            (str): Minimum Phred per base, minimum mean Phred per read, and offset.
+        """
+        return f'q{self.min_phred}:m{self.mean_phred}:o{self.offset}'
+
+
+class HitBatch:
+    """Hits of a probe kept as fixed-width NumPy byte arrays, so codon slicing and Phred's
+    filtering run as single array operations over the whole batch.
+    """
+    def __init__(self, reads: Sequence[bytes], qualities: Sequence[bytes], ends: Sequence[int]):
+        """Constructor for HitBatch class.
+
+        Args:
+            reads (Sequence[bytes]): Sequence of each read.
+            qualities (Sequence[bytes]): Phred's quality of each read.
+            ends (Sequence[int]): Read position where the probe ends in each read.
+        """
+        self.reads: np.ndarray = np.array(reads, dtype=bytes)
+        self.qualities: np.ndarray = np.array(qualities, dtype=bytes)
+        self.ends: np.ndarray = np.asarray(ends, dtype=np.int64)
+
+
+    @classmethod
+    def from_hits(cls, hits: Sequence[Hit]) -> 'HitBatch':
+        """Build a batch from the hits yielded by the scanner.
+
+        Args:
+            hits (Sequence[Hit]): Hits of the same probe.
+
+        Returns:
+            (HitBatch): Batch with the reads, qualities and probe ends of the hits.
+        """
+        return cls([hit.read for hit in hits], [hit.quality for hit in hits], [hit.end for hit in hits])
+
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+
+    def codons(self, starts: np.ndarray,
+               quality: QualityModel = QualityModel()) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Slice the nucleotide triplet starting at each position, code it as a column of the codon
+        count matrix, and check its Phred's quality on the uint8 quality arrays of the batch.
+
+        Args:
+            starts (np.ndarray): Read position where the codon starts in each read.
+            quality (QualityModel): Phred's quality filter, with Phred+33 if its offset is not set.
+
+        Returns:
+            (Tuple[np.ndarray, np.ndarray, np.ndarray]): Codon code of each read, a mask of the codons
+                                                         fully inside the read, and a mask of those
+                                                         that pass the Phred's filter too.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+
+        offset: int = quality.offset if quality.offset is not None else 33
+        reads: np.ndarray = self.reads.view(np.uint8).reshape(len(self), -1)
+        qualities: np.ndarray = self.qualities.view(np.uint8).reshape(len(self), -1)
+        lengths: np.ndarray = np.char.str_len(self.qualities)
+        columns: np.ndarray = starts[:, None] + np.arange(3)
+        inside: np.ndarray = (starts >= 0) & (starts + 3 <= np.char.str_len(self.reads)) & (starts + 3 <= lengths)
+        rows: np.ndarray = np.arange(len(self))[:, None]
+
+        bases: np.ndarray = BASE_CODES[reads[rows, np.clip(columns, 0, reads.shape[1] - 1)]]
+        codes: np.ndarray = np.where((bases < 4).all(axis=1), bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2],
+                                     OTHER_CODON)
+        phreds: np.ndarray = qualities[rows, np.clip(columns, 0, qualities.shape[1] - 1)]
+        passed: np.ndarray = inside & (phreds >= offset + quality.min_phred).all(axis=1)
+        if quality.mean_phred is not None:
+            passed &= qualities.sum(axis=1, dtype=np.int64) >= (offset + quality.mean_phred) * lengths
+        return codes, inside, passed
+
+
+class CodonCounter:
+    """Stream the scanner hits through codon calling into integer count matrices of probe rows by
+    codons (the 64 codons, and NNN for those with other bases), so only the matrices, and one
+    example read for each codon found, are kept in memory. The raw counts, before the Phred's
+    filter, are kept along the filtered ones, so the quality thresholds can be tuned without
+    scanning the sample again. Counters of the same probe rows, like the ones of the shards of a
+    sample or of several samples, are merged by adding their matrices.
+    """
+    def __init__(self, targets: Iterable[Tuple[Hashable, str, int]], chunk_size: int = 65536,
+                 quality: QualityModel = QualityModel()):
+        """Constructor for CodonCounter class.
+
+        Args:
+            targets (Iterable[Tuple[Hashable, str, int]]): Row key, probe and nucleotide position
+                                                           after the codon matching of each probe row.
+            chunk_size (int): Maximum number of hits buffered before calling their codons.
+            quality (QualityModel): Phred's quality filter of the codons.
+        """
+        self.rows: List[Hashable] = []
+        self.index: Dict[Hashable, int] = {}
+        self.targets: Dict[str, List[Tuple[int, int]]] = {}
+        for row, probe, position in targets:
+            self.index[row] = len(self.rows)
+            self.rows.append(row)
+            self.targets.setdefault(probe, []).append((self.index[row], int(position)))
+        self.chunk_size: int = chunk_size
+        self.quality: QualityModel = quality
+        self.counts: np.ndarray = np.zeros((len(self.rows), len(CODONS)), dtype=np.int64)
+        self.raw: np.ndarray = np.zeros((len(self.rows), len(CODONS)), dtype=np.int64)
+        self.examples: Dict[Tuple[int, int], Tuple[int, str]] = {}
+        self.pending: Dict[str, List[Hit]] = {}
+        self.buffered: int = 0
+
+
+    def update(self, hits: Iterable[Hit]) -> 'CodonCounter':
+        """Count the codons of a stream of hits in chunks of bounded size.
+
+        Args:
+            hits (Iterable[Hit]): Hits yielded by the scanner.
+
+        Returns:
+            (CodonCounter): The same counter, updated.
+        """
+        for hit in hits:
+            self.pending.setdefault(hit.probe, []).append(hit)
+            self.buffered += 1
+            if self.buffered >= self.chunk_size:
+                self.flush()
+        self.flush()
+        return self
+
+
+    def flush(self) -> None:
+        """Call the codons of the buffered hits and add them to the count matrices."""
+        for probe, hits in self.pending.items():
+            batch: HitBatch = HitBatch.from_hits(hits)
+            for index, position in self.targets.get(probe, []):
+                starts: np.ndarray = batch.ends + position - 1
+                codes, inside, passed = batch.codons(starts, self.quality)
+                found: np.ndarray = np.flatnonzero(inside)
+                codons, first, counts = np.unique(codes[found], return_index=True, return_counts=True)
+                new: np.ndarray = self.raw[index, codons] == 0
+                for code, hit in zip(codons[new], found[first[new]]):
+                    self.examples[index, int(code)] = (int(starts[hit]), batch.reads[hit].decode())
+                self.raw[index, codons] += counts
+                self.counts[index] += np.bincount(codes[passed], minlength=len(CODONS))
+        self.pending.clear()
+        self.buffered = 0
+
+
+    def merge(self, other: 'CodonCounter') -> 'CodonCounter':
+        """Add the count matrices of another counter of the same probe rows, like the counter of
+        another shard of the fastq file. The example reads of this counter are kept before the other ones.
+
+        Args:
+            other (CodonCounter): Counter to add.
+
+        Returns:
+            (CodonCounter): The same counter, updated.
+        """
+        if other.rows != self.rows:
+            raise ValueError('Only the counters of the same probe rows can be merged')
+        self.flush()
+        other.flush()
+        for index, code in zip(*(axis.tolist() for axis in np.nonzero((self.raw == 0) & (other.raw > 0)))):
+            self.examples[index, code] = other.examples[index, code]
+        self.counts += other.counts
+        self.raw += other.raw
+        return self
+
+
+    def add_results(self, row: Hashable, results: Optional[List[Tuple[str, int, str, int, int]]]) -> None:
+        """Add the codons counted for a probe row elsewhere, like the count cache of the sample.
+
+        Args:
+            row (Hashable): Key of the probe row.
+            results (List[Tuple[str, int, str, int, int]]): Codon, codon position and read of its first hit,
+                                                            and quality-filtered and raw counts of each codon found.
+        """
+        index: int = self.index[row]
+        for codon, start, read, count, raw in results or []:
+            code: int = CODON_CODES.get(codon.upper(), OTHER_CODON)
+            if not self.raw[index, code]:
+                self.examples[index, code] = (start, read)
+            self.counts[index, code] += count
+            self.raw[index, code] += raw
+
+
+    def results(self, row: Hashable) -> Optional[List[Tuple[str, int, str, int, int]]]:
+        """Codons counted for a probe row.
+
+        Args:
+            row (Hashable): Key of the probe row.
+
+        Returns:
+            (List[Tuple[str, int, str, int, int]]): Codon, codon position and read of its first hit, and
+                                                    quality-filtered and raw counts of each codon found,
+                                                    or None if there is none.
+        """
+        index: int = self.index[row]
+        codes: np.ndarray = np.flatnonzero(self.raw[index])
+        if not len(codes):
+            return None
+        return [(str(CODONS[code]), *self.examples[index, code], int(self.counts[index, code]),
+                 int(self.raw[index, code])) for code in codes.tolist()]
+
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Codons found for every probe row as the columns of a table, derived from the count matrices.
+
+        Returns:
+            (Dict[str, np.ndarray]): Row key, mutated codon, codon position and read of its first hit,
+                                     and quality-filtered and raw counts of each codon found, in row order.
+        """
+        indexes, codes = np.nonzero(self.raw)
+        examples: List[Tuple[int, str]] = [self.examples[index, code]
+                                           for index, code in zip(indexes.tolist(), codes.tolist())]
+        return {'Row': np.array(self.rows)[indexes] if len(self.rows) else np.empty(0, dtype=np.int64),
+                'Mutated Codon': CODONS[codes],
+                'Position': np.array([start for start, _ in examples], dtype=np.int64),
+                'Read': np.array([read for _, read in examples], dtype=object),
+                'Counts': self.counts[indexes, codes],
+                'Raw Counts': self.raw[indexes, codes]}
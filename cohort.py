@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import re
+from datetime import datetime
+from glob import glob
+from multiprocessing import Pool
+from time import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+import pandas as pd
+from analysis import count_codons
+from codons import CodonCounter, QualityModel
+from fastq import list_fastq
+from incremental import CountCache
+from metrics import PROFILERS, RunMetrics, profiled
+from probes import INDEX_VERSION, ProbeIndex
+from reports import ReportWriter, get_writers
+from scanner import ProbeScanner
+from store import ResultStore, config_key
+from summary import CohortMatrix
+
+Sample = Tuple[str, List[str]]
+
+
+class CohortWorker:
+    """Probe set and scanner of a worker process, parsed once and reused for all its samples.
+    """
+    def __init__(self, probes_file: str, reference_file: str, profiler: Optional[str] = None, profile_dir: str = '.',
+                 incremental: bool = False, paired: bool = False, dedup: bool = False,
+                 quality: QualityModel = QualityModel()):
+        """Constructor for CohortWorker class.
+
+        Args:
+            probes_file (str): Filename of the csv with probes and position to search.
+            reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+            profiler (str): Profiler of each sample, any of cprofile and pyinstrument, none by default.
+            profile_dir (str): Folder of the profiles.
+            incremental (bool): Reuse the cached codon counts of the samples, scanning only the new or edited probes.
+            paired (bool): Read the _1 and _2 mates of the paired-end runs together, counting each fragment once per probe.
+            dedup (bool): Count once the fragments with the same sequences (PCR duplicates).
+            quality (QualityModel): Phred's quality filter of the codons, its offset is detected from each sample if not set.
+        """
+        self.paired: bool = paired
+        self.quality: QualityModel = quality
+        self.dedup: bool = dedup
+        self.profiler: Optional[str] = profiler
+        self.profile_dir: str = profile_dir
+        self.cache: Optional[CountCache] = CountCache() if incremental else None
+        self.index: ProbeIndex = ProbeIndex.cached(probes_file, reference_file)
+        self.probes: pd.DataFrame = self.index.frame()
+        self.scanner = ProbeScanner.from_index(self.index)
+
+
+    def count(self, sample: str, files: List[str]) -> Tuple[pd.DataFrame, RunMetrics]:
+        """Count the codons of every probe in the fastq files of a sample.
+
+        Args:
+            sample (str): Name of the sample.
+            files (List[str]): Fastq and fastq.gz files of the sample.
+
+        Returns:
+            (Tuple[pd.DataFrame, RunMetrics]): Codon counts and frequencies, and metrics of the sample.
+        """
+        metrics = RunMetrics(sample)
+        with profiled(self.profiler, os.path.join(self.profile_dir, sample)):
+            with metrics.span('scanning'):
+                counter: CodonCounter = count_codons(self.index, files, metrics, self.paired, self.dedup,
+                                                     cache=self.cache, scanner=self.scanner, quality=self.quality)
+
+            with metrics.span('aggregation'):
+                columns: Dict[str, np.ndarray] = counter.columns()
+                df: pd.DataFrame = self.probes.take(columns['Row'])[['Gen', 'Gen-Position', 'Position', 'Reference Codon']]
+                df.reset_index(drop=True, inplace=True)
+                df.insert(0, 'Sample', sample)
+                df.insert(4, 'Mutated Codon', columns['Mutated Codon'])
+                df['Counts'] = columns['Counts']
+                df['Raw Counts'] = columns['Raw Counts']
+                loci: pd.Series = df.groupby(['Gen-Position', 'Position'])['Counts'].transform('sum')
+                df['Frequencies'] = (df['Counts'] * 100 / loci).fillna(0.0)
+        return df, metrics
+
+
+worker: Optional[CohortWorker] = None
+
+
+def init_worker(probes_file: str, reference_file: str, profiler: Optional[str] = None,
+                profile_dir: str = '.', incremental: bool = False, paired: bool = False, dedup: bool = False,
+                quality: QualityModel = QualityModel()) -> None:
+    """Build the probe set and scanner of the worker process.
+
+    Args:
+        probes_file (str): Filename of the csv with probes and position to search.
+        reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+        profiler (str): Profiler of each sample, any of cprofile and pyinstrument, none by default.
+        profile_dir (str): Folder of the profiles.
+        incremental (bool): Reuse the cached codon counts of the samples, scanning only the new or edited probes.
+        paired (bool): Read the _1 and _2 mates of the paired-end runs together, counting each fragment once per probe.
+        dedup (bool): Count once the fragments with the same sequences (PCR duplicates).
+        quality (QualityModel): Phred's quality filter of the codons, its offset is detected from each sample if not set.
+    """
+    global worker
+    worker = CohortWorker(probes_file, reference_file, profiler, profile_dir, incremental, paired, dedup, quality)
+
+
+def count_sample(sample: Sample) -> Tuple[str, Optional[pd.DataFrame], Optional[RunMetrics], Optional[str]]:
+    """Count the codons of a sample in the worker process. A sample that fails (a malformed or
+    missing fastq file) is reported back instead of stopping the whole cohort.
+
+    Args:
+        sample (Sample): Name and fastq files of the sample.
+
+    Returns:
+        (Tuple[str, pd.DataFrame, RunMetrics, str]): Name, codon counts and frequencies, metrics,
+                                                     and error of the sample, None where it does not apply.
+    """
+    name, files = sample
+    try:
+        table, metrics = worker.count(name, files)
+    except Exception as error:
+        return name, None, None, f'{type(error).__name__}: {error}'
+    return name, table, metrics, None
+
+
+def sample_name(path: str) -> str:
+    """Name a sample after its folder or fastq file.
+
+    Args:
+        path (str): Folder or fastq file of the sample.
+
+    Returns:
+        (str): Name of the sample.
+    """
+    return re.sub(r'\.fastq(\.gz)?$', '', os.path.basename(os.path.normpath(path)))
+
+
+def read_manifest(manifest: str, root: str = '.') -> List[Sample]:
+    """Read the samples of a cohort. Each line of the manifest is a folder or fastq file, a sample
+    name followed by its folders or fastq files, or a run accession like the ones listed in
+    Ibilce/SraPeruList.txt, whose fastq files are looked up in the root folder.
+
+    Args:
+        manifest (str): Path of the manifest file.
+        root (str): Folder where the relative paths and the run accessions are looked up.
+
+    Returns:
+        (List[Sample]): Name and fastq files of each sample.
+    """
+    samples: List[Sample] = []
+    with open(manifest) as handle:
+        for line in handle:
+            fields: List[str] = line.replace(',', ' ').split()
+            if not fields or fields[0].startswith('#'):
+                continue
+
+            if len(fields) > 1:
+                name, paths = fields[0], [os.path.join(root, field) for field in fields[1:]]
+            elif os.path.exists(os.path.join(root, fields[0])):
+                name, paths = sample_name(fields[0]), [os.path.join(root, fields[0])]
+            else:
+                # Only <run>.fastq and the <run>_1 and <run>_2 mates, SRR123456 must not take SRR1234567's files.
+                name = fields[0]
+                paths = [file for extension in ('fastq', 'fastq.gz')
+                         for file in sorted(glob(f'{root}/{name}.{extension}') + glob(f'{root}/{name}_[12].{extension}'))]
+
+            files: List[str] = [file for path in paths for file in list_fastq(path)]
+            if not files:
+                print(f'No fastq files found for sample {name}')
+                continue
+            samples.append((name, files))
+    return samples
+
+
+def run_cohort(samples: List[Sample], output: str, workers: Optional[int] = None,
+               probes_file: str = 'forward.csv', reference_file: str = 'Probes_MTB.csv',
+               formats: Sequence[str] = ('csv',), profiler: Optional[str] = None,
+               incremental: bool = False, paired: bool = False, dedup: bool = False,
+               store: Optional[str] = None, rerun: bool = False,
+               quality: QualityModel = QualityModel(), minor_frequency: float = 1.0,
+               fixed_frequency: float = 95.0, min_depth: int = 10) -> pd.DataFrame:
+    """Process the samples across a pool of worker processes. The codon counts of each sample are
+    recorded in the result store as soon as it finishes and written in the partitions
+    Sample=<sample>/Gen=<gen> of the Codons dataset, along with its JSON run summary in
+    Run_Summary/<sample>.json. The samples already in the store, with the same probe set and
+    options, are skipped, so a killed run is resumed by running it again. The samples that fail
+    are recorded and retried on the next run. The unpartitioned formats (excel) get a combined
+    cohort report at the end, unless it is larger than an Excel sheet. Then the counts of the cohort are aggregated in the samples x loci x
+    codons matrix of <output>/Cohort_Matrix, and the minor variants and the resistance summary by
+    Drug Resistance class are written from it.
+
+    Args:
+        samples (List[Sample]): Name and fastq files of each sample.
+        output (str): Folder of the reports.
+        workers (int): Number of worker processes, all the CPUs by default.
+        probes_file (str): Filename of the csv with probes and position to search.
+        reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+        formats (Sequence[str]): Report formats, any of csv, parquet, feather, and excel.
+        profiler (str): Profiler of each sample, any of cprofile and pyinstrument, written in <output>/Profile.
+        incremental (bool): Reuse the cached codon counts of the samples, scanning only the new or edited probes.
+        paired (bool): Read the _1 and _2 mates of the paired-end runs together, counting each fragment once per probe.
+        dedup (bool): Count once the fragments with the same sequences (PCR duplicates).
+        store (str): Path of the SQLite result store, <output>/results.sqlite by default.
+        rerun (bool): Process again the samples already in the result store.
+        quality (QualityModel): Phred's quality filter of the codons, its offset is detected from each sample if not set.
+        minor_frequency (float): Lowest percent frequency of a minor variant.
+        fixed_frequency (float): Percent frequency from which a variant is fixed instead of minor.
+        min_depth (int): Lowest depth of a locus to call its variants.
+
+    Returns:
+        (pd.DataFrame): Codon counts and frequencies of all the samples.
+    """
+    start = time()
+    writers: List[ReportWriter] = get_writers(formats, output)
+    ProbeIndex.cached(probes_file, reference_file)
+    config: str = config_key(probes_file, reference_file, index=INDEX_VERSION, paired=paired, dedup=dedup,
+                             quality=quality.key())
+    files: Dict[str, List[str]] = dict(samples)
+    initargs: tuple = (probes_file, reference_file, profiler, os.path.join(output, 'Profile'), incremental, paired, dedup,
+                          quality)
+    with ResultStore(store or os.path.join(output, 'results.sqlite')) as results:
+        finished: Set[str] = set() if rerun else results.finished(config)
+        pending: List[Sample] = [sample for sample in samples if sample[0] not in finished]
+        if len(pending) < len(samples):
+            print(f'{len(samples) - len(pending)} samples already processed, skipping them')
+
+        done: int = len(samples) - len(pending)
+        with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+            for name, table, metrics, error in pool.imap_unordered(count_sample, pending):
+                if error is not None:
+                    results.fail(name, config, files[name], error)
+                    print(f'Sample {name} failed: {error}')
+                    continue
+                with metrics.span('report writing'):
+                    for writer in writers:
+                        if writer.partitioned:
+                            writer.write('Codons', table)
+                metrics.write(os.path.join(output, 'Run_Summary', f'{name}.json'))
+                results.save(name, config, files[name], table, metrics.summary())
+                done += 1
+                print(f'Sample {name} processed ({done}/{len(samples)})')
+
+        cohort: pd.DataFrame = results.codons(list(files), config)
+        matrix = CohortMatrix.build(results, config, probes_file, reference_file,
+                                    os.path.join(output, 'Cohort_Matrix'), list(files))
+    date: str = datetime.today().strftime('%Y-%m-%d-%H-%M')
+    variants: pd.DataFrame = matrix.minor_variants(minor_frequency, fixed_frequency, min_depth)
+    resistance: pd.DataFrame = matrix.resistance_summary(minor_frequency, fixed_frequency, min_depth)
+    for writer in writers:
+        if not writer.partitioned:
+            writer.write(f'Cohort_Report_{date}', cohort)
+        writer.write(f'Minor_Variants_{date}', variants)
+        writer.write(f'Resistance_Summary_{date}', resistance)
+    print(f'Total time to cohort process:  {time() - start} seconds')
+    return cohort
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Liponium cohort mode: process many samples in a pool of workers.')
+    parser.add_argument('manifest', help='File with one sample (folder, fastq files, or run accession) per line')
+    parser.add_argument('--root', default='.', help='Folder where the samples of the manifest are looked up')
+    parser.add_argument('--output', default='./Reports/Cohort', help='Folder of the reports')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--probes', default='forward.csv', help='Csv with probes and position to search')
+    parser.add_argument('--reference', default='Probes_MTB.csv', help='Csv with the reference codons')
+    parser.add_argument('--formats', default='csv',
+                        help='Comma separated report formats: csv, parquet, feather, excel')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='Profile each sample with cProfile or pyinstrument, written in <output>/Profile')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse the cached codon counts of the samples, scanning only the new or edited probes')
+    parser.add_argument('--paired', action='store_true',
+                        help='Read the _1 and _2 mates together, counting each fragment once per probe')
+    parser.add_argument('--dedup', action='store_true', help='Count once the duplicated fragments')
+    parser.add_argument('--store', default=None, help='SQLite result store, <output>/results.sqlite by default')
+    parser.add_argument('--rerun', action='store_true', help='Process again the samples already in the result store')
+    parser.add_argument('--min-quality', type=int, default=30, help='Minimum Phred quality of each base of a codon')
+    parser.add_argument('--mean-quality', type=float, default=None, help='Minimum mean Phred quality of a read')
+    parser.add_argument('--phred-offset', type=int, choices=(33, 64), default=None,
+                        help='Offset of the quality characters, detected from the fastq files by default')
+    parser.add_argument('--minor-frequency', type=float, default=1.0, help='Lowest percent frequency of a minor variant')
+    parser.add_argument('--fixed-frequency', type=float, default=95.0, help='Percent frequency of a fixed variant')
+    parser.add_argument('--min-depth', type=int, default=10, help='Lowest depth of a locus to call its variants')
+    args = parser.parse_args()
+
+    run_cohort(read_manifest(args.manifest, args.root), args.output, args.workers, args.probes, args.reference,
+               args.formats.split(','), args.profile, args.incremental,
+               args.paired, args.dedup, args.store, args.rerun,
+               QualityModel(args.min_quality, args.mean_quality, args.phred_offset),
+               args.minor_frequency, args.fixed_frequency, args.min_depth)
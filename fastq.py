@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import re
+from contextlib import contextmanager
+from glob import glob
+from shutil import which
+from itertools import islice, zip_longest
+from subprocess import PIPE, Popen
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+BUFFER_SIZE: int = 1 << 20
+NEWLINE: int = ord('\n')
+CARRIAGE_RETURN: int = ord('\r')
+HEADER: int = ord('@')
+SEPARATOR: int = ord('+')
+PHRED64_LOWEST: int = ord(';')
+PHRED33_HIGHEST: int = ord('J')
+MATE = re.compile(r'^(.*)_([12])(\.fastq(?:\.gz)?)$')
+Record = Tuple[memoryview, memoryview]
+
+
+def list_fastq(path: str) -> List[str]:
+    """List the fastq and fastq.gz files of a folder, or the file itself if the path is a file.
+
+    Args:
+        path (str): Path of a folder with the fastq and fastq.gz files, or of a single file.
+
+    Returns:
+        (List[str]): All the files to be processed.
+    """
+    if os.path.isfile(path):
+        return [path]
+    fastq_files: List[str] = sorted(glob(f'{path}/*.fastq'))
+    fastq_files.extend(sorted(glob(f'{path}/*.fastq.gz')))
+    return fastq_files
+
+
+@contextmanager
+def open_fastq(file_name: str) -> Iterator[IO[bytes]]:
+    """Open a fastq file as binary, decompressing the .gz files in streaming without temporal files.
+
+    The compressed files are piped through pigz when it is installed, otherwise they are read with
+    the gzip module. Both handle the multi-member files written by pigz and keep the memory bounded
+    to the pipe and read buffers.
+
+    Args:
+        file_name (str): Path of the fastq or fastq.gz file.
+
+    Returns:
+        (Iterator[IO[bytes]]): Binary handle with the decompressed fastq data.
+    """
+    if not file_name.endswith('.gz'):
+        with open(file_name, 'rb') as handle:
+            yield handle
+        return
+
+    pigz: str = which('pigz')
+    if pigz is None:
+        with gzip.open(file_name, 'rb') as handle:
+            yield handle
+        return
+
+    process: Popen = Popen([pigz, '-dc', file_name], stdout=PIPE, bufsize=BUFFER_SIZE)
+    try:
+        yield process.stdout
+    finally:
+        process.stdout.close()
+        if process.wait() not in (0, -13):
+            raise OSError(f'pigz failed decompressing {file_name} with exit status {process.returncode}')
+
+
+def parse_fastq(handle: IO[bytes], buffer_size: int = BUFFER_SIZE) -> Iterator[Record]:
+    """Split a binary fastq stream in records, reading it in blocks and yielding the sequence and
+    quality of each read as memoryview slices of the block, without a string per read. The line
+    ends of a whole block are found at once with NumPy and the records are told apart by their
+    4 lines, so any header (ERR, SRR, DRR, Illumina, ...) works. The empty lines are kept, so the
+    zero-length reads keep their empty sequence and quality lines, and only the blank lines between
+    records are skipped; Windows line ends are removed. Every record is checked to start with '@',
+    to have its separator line starting with '+', and a quality as long as its sequence. The partial
+    record at the end of a block is completed with the next block, which copies that block once.
+
+    Args:
+        handle (IO[bytes]): Binary handle with the fastq data.
+        buffer_size (int): Bytes read in each block.
+
+    Returns:
+        (Iterator[Record]): Sequence and Phred's quality of each read. A malformed record, or data
+                            ending in the middle of a record, raises a ValueError.
+    """
+    rest: bytes = b''
+    while True:
+        block: bytes = handle.read(buffer_size)
+        data: bytes = rest + block if rest else block
+        if not block and data.strip():
+            data += b'\n'
+
+        array: np.ndarray = np.frombuffer(data, dtype=np.uint8)
+        newlines: np.ndarray = np.flatnonzero(array == NEWLINE)
+        begins: np.ndarray = np.zeros(len(newlines), dtype=np.int64)
+        begins[1:] = newlines[:-1] + 1
+        ends: np.ndarray = newlines - (array[np.maximum(newlines - 1, 0)] == CARRIAGE_RETURN)
+        lines: int = len(ends)
+
+        empty: np.ndarray = ends == begins
+        if not empty.any():
+            starts: np.ndarray = np.arange(0, lines // 4 * 4, 4)
+            consumed: int = len(starts) * 4
+        else:
+            # Blank lines are skipped only where a record starts, the ones inside a record are empty reads.
+            found: List[int] = []
+            consumed = 0
+            blank: List[bool] = empty.tolist()
+            while True:
+                while consumed < lines and blank[consumed]:
+                    consumed += 1
+                if consumed + 4 > lines:
+                    break
+                found.append(consumed)
+                consumed += 4
+            starts = np.array(found, dtype=np.int64)
+
+        headers: np.ndarray = array[begins[starts]] != HEADER
+        separators: np.ndarray = empty[starts + 2] | (array[begins[starts + 2]] != SEPARATOR)
+        lengths: np.ndarray = (ends[starts + 1] - begins[starts + 1]) != (ends[starts + 3] - begins[starts + 3])
+        wrong: np.ndarray = np.flatnonzero(headers | separators | lengths)
+        if len(wrong):
+            line: int = int(starts[wrong[0]])
+            record: bytes = b'\n'.join(data[begins[line + offset]:ends[line + offset]] for offset in range(4))
+            problem: str = ('its header does not start with @' if headers[wrong[0]] else
+                            'its separator does not start with +' if separators[wrong[0]] else
+                            'its sequence and quality lengths differ')
+            raise ValueError(f'Malformed fastq record, {problem}: {record[:200]!r}')
+
+        view: memoryview = memoryview(data)
+        for sequence, sequence_end, quality, quality_end in zip(begins[starts + 1].tolist(), ends[starts + 1].tolist(),
+                                                                begins[starts + 3].tolist(), ends[starts + 3].tolist()):
+            yield view[sequence:sequence_end], view[quality:quality_end]
+
+        if consumed < lines:
+            rest = data[begins[consumed]:]
+        else:
+            rest = data[newlines[-1] + 1:] if len(newlines) else data
+        if not block:
+            if rest.strip():
+                raise ValueError(f'Truncated fastq record at the end of the data: {rest[:80]!r}')
+            return
+
+
+def read_fastq(file_name: str) -> Iterator[Record]:
+    """Read a fastq file record by record, this is the reader shared by all the matching paths.
+
+    Args:
+        file_name (str): Path of the fastq or fastq.gz file.
+
+    Returns:
+        (Iterator[Record]): Sequence and Phred's quality of each read, as
+                                                   read-only views of the decompressed data.
+    """
+    with open_fastq(file_name) as handle:
+        yield from parse_fastq(handle)
+
+
+def phred_offset(files: Sequence[str], records: int = 10000) -> int:
+    """Detect the Phred's encoding of the fastq files from the quality characters of their first
+    records. Phred+64 (Solexa and Illumina 1.3 to 1.7) is obsolete, so it is only taken on positive
+    evidence: characters above 'J', the highest of Phred+33 (Sanger, Illumina 1.8 and later), and
+    none below ';', the lowest of Phred+64. Any other file, like one whose qualities are all high,
+    is Phred+33.
+
+    Args:
+        files (Sequence[str]): Paths of the fastq and fastq.gz files.
+        records (int): Records read from the start of each file.
+
+    Returns:
+        (int): Offset of the quality characters, 33 or 64.
+    """
+    lowest: int = 255
+    highest: int = 0
+    for file_name in files:
+        with open_fastq(file_name) as handle:
+            for _, quality in islice(parse_fastq(handle), records):
+                if len(quality):
+                    lowest = min(lowest, min(quality))
+                    highest = max(highest, max(quality))
+        if lowest < PHRED64_LOWEST:
+            return 33
+    return 64 if highest > PHRED33_HIGHEST else 33
+
+
+def pair_fastq(files: Sequence[str]) -> List[Tuple[str, ...]]:
+    """Group the mates of the paired-end runs, the <run>_1 and <run>_2 fastq files written by
+    ``fasterq-dump -S``. The files without a mate, like the <run>.fastq of the unpaired reads, are left alone.
+
+    Args:
+        files (Sequence[str]): Paths of the fastq and fastq.gz files.
+
+    Returns:
+        (List[Tuple[str, ...]]): Files of each run, both mates in order or a single file.
+    """
+    groups: Dict[Tuple[str, str], List[Optional[str]]] = {}
+    for file_name in files:
+        match = MATE.match(file_name)
+        if match is None:
+            groups[('single', file_name)] = [file_name]
+            continue
+        mates: List[Optional[str]] = groups.setdefault(('paired', match.group(1) + match.group(3)), [None, None])
+        mates[int(match.group(2)) - 1] = file_name
+    return [tuple(file_name for file_name in group if file_name is not None) for group in groups.values()]
+
+
+def zip_mates(streams: Sequence[Iterable[Record]], files: Sequence[str]) -> Iterator[Tuple[Record, ...]]:
+    """Read the mates of a paired-end run together, record by record, so each fragment is seen at
+    once while only a block of each file is held in memory.
+
+    Args:
+        streams (Sequence[Iterable[Record]]): Records of each mate file.
+        files (Sequence[str]): Paths of the mate files.
+
+    Returns:
+        (Iterator[Tuple[Record, ...]]): Sequence and Phred's quality of the mates of each fragment.
+    """
+    for mates in zip_longest(*streams):
+        if None in mates:
+            raise ValueError(f'The paired-end files {", ".join(files)} have a different number of reads')
+        yield mates
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+from codons import CodonCounter, QualityModel
+from fastq import BUFFER_SIZE
+from metrics import RunMetrics
+from probes import CACHE_DIR, ProbeIndex
+from scanner import ProbeScanner
+from sharding import count_sharded
+
+COUNTS_VERSION: int = 3
+Results = Optional[List[Tuple[str, int, str, int, int]]]
+
+
+def target_key(probe: str, position: int, mismatches: int, paired: bool = False, dedup: bool = False,
+               quality: QualityModel = QualityModel()) -> str:
+    """Key of the codon counts of a probe row, it changes when anything that changes them does.
+
+    Args:
+        probe (str): Sequence of the probe.
+        position (int): Nucleotide position after the codon matching.
+        mismatches (int): Maximum number of substitutions allowed between the probe and a read.
+        paired (bool): The mates of the paired-end runs were counted together.
+        dedup (bool): The duplicated fragments were counted once.
+        quality (QualityModel): Phred's quality filter of the codons.
+
+    Returns:
+        (str): Key of the probe row.
+    """
+    return f'{COUNTS_VERSION}:{mismatches}:{paired:d}{dedup:d}:{quality.key()}:{probe}:{position}'
+
+
+class CountCache:
+    """Content-addressed cache of the codon counts of each sample and probe row. A sample is
+    addressed by the checksum of its fastq files and its counts by probe sequence and position, so
+    adding or editing probes only needs the new probe rows to be scanned, and renaming or moving
+    the fastq files keeps their counts.
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        """Constructor for CountCache class.
+
+        Args:
+            cache_dir (str): Folder of the cache.
+        """
+        self.directory: str = os.path.join(cache_dir, 'counts')
+        self.digests: str = os.path.join(cache_dir, 'files')
+
+
+    def file_digest(self, file_name: str) -> str:
+        """Checksum of a fastq file. It is remembered by path, size, and modification time, so each
+        file is read for it only once.
+
+        Args:
+            file_name (str): Path of the fastq or fastq.gz file.
+
+        Returns:
+            (str): SHA-256 of the file contents.
+        """
+        stat: os.stat_result = os.stat(file_name)
+        stamp: str = f'{os.path.abspath(file_name)}:{stat.st_size}:{stat.st_mtime_ns}'
+        memo: str = os.path.join(self.digests, hashlib.sha256(stamp.encode()).hexdigest())
+        if os.path.isfile(memo):
+            with open(memo) as handle:
+                return handle.read()
+
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as handle:
+            for block in iter(lambda: handle.read(BUFFER_SIZE), b''):
+                digest.update(block)
+        write_atomic(memo, digest.hexdigest())
+        return digest.hexdigest()
+
+
+    def sample_key(self, files: Sequence[str]) -> str:
+        """Key of a sample, the checksum of the checksums of its fastq files.
+
+        Args:
+            files (Sequence[str]): Fastq and fastq.gz files of the sample.
+
+        Returns:
+            (str): Key of the sample.
+        """
+        return hashlib.sha256(' '.join(sorted(self.file_digest(file) for file in files)).encode()).hexdigest()
+
+
+    def load(self, key: str) -> Dict[str, Results]:
+        """Codon counts cached for a sample.
+
+        Args:
+            key (str): Key of the sample.
+
+        Returns:
+            (Dict[str, Results]): Codon counts of each probe row key, empty if the sample is not cached.
+        """
+        path: str = os.path.join(self.directory, f'{key}.json')
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as handle:
+            return {target: [tuple(codon) for codon in results] if results is not None else None
+                    for target, results in json.load(handle).items()}
+
+
+    def save(self, key: str, counts: Dict[str, Results]) -> None:
+        """Write the codon counts of a sample, atomically.
+
+        Args:
+            key (str): Key of the sample.
+            counts (Dict[str, Results]): Codon counts of each probe row key.
+        """
+        write_atomic(os.path.join(self.directory, f'{key}.json'), json.dumps(counts))
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Write a text file through a temporal file renamed in place, so readers never see it half written.
+
+    Args:
+        path (str): Path of the file.
+        text (str): Contents of the file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, staging = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'w') as handle:
+        handle.write(text)
+    os.replace(staging, path)
+
+
+def count_incremental(index: ProbeIndex, files: Sequence[str], cache: CountCache,
+                      metrics: Optional[RunMetrics] = None, paired: bool = False, dedup: bool = False,
+                      workers: Optional[int] = 1, quality: QualityModel = QualityModel()) -> CodonCounter:
+    """Count the codons of every probe row of the index in a sample, scanning the fastq files only
+    for the probe rows that are not in the cache yet.
+
+    Args:
+        index (ProbeIndex): Compiled probe index.
+        files (Sequence[str]): Fastq and fastq.gz files of the sample.
+        cache (CountCache): Cache of the codon counts.
+        metrics (RunMetrics): Metrics of the run.
+        paired (bool): Read the mates of the paired-end runs together, counting each fragment once per probe.
+        dedup (bool): Count once the fragments with the same sequences.
+        workers (int): Worker processes scanning the shards of the fastq files, all the CPUs if None.
+        quality (QualityModel): Phred's quality filter of the codons.
+
+    Returns:
+        (CodonCounter): Codon counter of all the probe rows of the index.
+    """
+    quality = quality.resolve(files)
+    key: str = cache.sample_key(files)
+    counts: Dict[str, Results] = cache.load(key)
+    targets: List[Tuple[int, str, int]] = list(index.targets())
+    keys: List[str] = [target_key(probe, position, index.mismatches, paired, dedup, quality)
+                       for _, probe, position in targets]
+    missing: List[Tuple[int, str, int]] = [target for target, target_id in zip(targets, keys) if target_id not in counts]
+
+    if metrics is not None:
+        metrics.add('cached_rows', len(targets) - len(missing))
+    if missing and workers != 1:
+        if paired or dedup:
+            raise ValueError('The fastq files are split in shards only for single-end reads without dedup')
+        scanned: CodonCounter = count_sharded(missing, index.mismatches, files, workers, metrics, quality=quality)
+    elif missing:
+        scanner = ProbeScanner([probe for _, probe, _ in missing], index.mismatches)
+        scanned = CodonCounter(missing, quality=quality)
+        scanned.update(scanner.scan(files, metrics, paired, dedup))
+    if missing:
+        for row, _, _ in missing:
+            counts[keys[row]] = scanned.results(row)
+        cache.save(key, counts)
+
+    counter = CodonCounter(targets, quality=quality)
+    for (row, _, _), target_id in zip(targets, keys):
+        counter.add_results(row, counts[target_id])
+    return counter
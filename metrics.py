@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, TypeVar
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILERS: Sequence[str] = ('cprofile', 'pyinstrument')
+Record = TypeVar('Record')
+
+
+def peak_rss() -> int:
+    """Peak resident memory of the process.
+
+    Returns:
+        (int): Peak resident set size in bytes, 0 where the resource module is not available (Windows).
+    """
+    if resource is None:
+        return 0
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunMetrics:
+    """Time, memory, and counters of the stages of a sample run, summarized as JSON.
+    """
+    def __init__(self, sample: str = ''):
+        """Constructor for RunMetrics class.
+
+        Args:
+            sample (str): Name of the sample.
+        """
+        self.sample: str = sample
+        self.started: float = time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {'reads': 0, 'bytes_read': 0, 'hits': 0}
+        self.hits_per_probe: Dict[str, int] = {}
+        self.settings: Dict[str, Any] = {}
+
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add the seconds spent in a stage and take the peak memory of the process at its end. The
+        peak is cumulative, the largest resident memory of the process since it started (ru_maxrss),
+        so it is not the peak within the stage; a stage that raises it is the one that needed more.
+
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): Seconds spent in the stage.
+        """
+        span: Dict[str, float] = self.stages.setdefault(stage, {'seconds': 0.0, 'peak_rss_bytes': 0})
+        span['seconds'] += seconds
+        span['peak_rss_bytes'] = peak_rss()
+
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator['RunMetrics']:
+        """Time the block as a stage of the run.
+
+        Args:
+            stage (str): Name of the stage.
+
+        Returns:
+            (Iterator[RunMetrics]): The metrics themselves.
+        """
+        start = time()
+        try:
+            yield self
+        finally:
+            self.record(stage, time() - start)
+
+
+    def timed(self, stage: str, records: Iterable[Record], counter: Optional[str] = 'reads') -> Iterator[Record]:
+        """Iterate the records of a stream counting them, and timing as a stage only the time spent producing
+        them, so the decompression and parsing of a fastq file is told apart from the matching of its reads.
+
+        Args:
+            stage (str): Name of the stage.
+            records (Iterable[Record]): Stream of records.
+            counter (str): Counter of the records, none if None.
+
+        Returns:
+            (Iterator[Record]): The same records.
+        """
+        iterator: Iterator[Record] = iter(records)
+        seconds: float = 0.0
+        count: int = 0
+        try:
+            while True:
+                start = time()
+                try:
+                    record: Record = next(iterator)
+                except StopIteration:
+                    break
+                seconds += time() - start
+                count += 1
+                yield record
+        finally:
+            self.record(stage, seconds)
+            if counter is not None:
+                self.add(counter, count)
+
+
+    def add(self, counter: str, value: int = 1) -> None:
+        """Increase a counter of the run.
+
+        Args:
+            counter (str): Name of the counter.
+            value (int): Amount to add.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+
+    def hit(self, probe: str) -> None:
+        """Count a read matching a probe.
+
+        Args:
+            probe (str): Sequence of the probe.
+        """
+        self.counters['hits'] += 1
+        self.hits_per_probe[probe] = self.hits_per_probe.get(probe, 0) + 1
+
+
+    def set(self, setting: str, value: Any) -> None:
+        """Record a setting of the run resolved at run time, like the Phred's offset detected.
+
+        Args:
+            setting (str): Name of the setting.
+            value (Any): Value of the setting.
+        """
+        self.settings[setting] = value
+
+
+    def merge(self, other: 'RunMetrics') -> 'RunMetrics':
+        """Add the stages and counters of the metrics of another process, like a shard worker. The
+        seconds of the stages are added up, so they are CPU seconds across the workers, and the
+        cumulative peak memory of a stage is the largest of the processes.
+
+        Args:
+            other (RunMetrics): Metrics to add.
+
+        Returns:
+            (RunMetrics): The same metrics, updated.
+        """
+        for stage, span in other.stages.items():
+            merged: Dict[str, float] = self.stages.setdefault(stage, {'seconds': 0.0, 'peak_rss_bytes': 0})
+            merged['seconds'] += span['seconds']
+            merged['peak_rss_bytes'] = max(merged['peak_rss_bytes'], span['peak_rss_bytes'])
+        for counter, value in other.counters.items():
+            self.add(counter, value)
+        for probe, hits in other.hits_per_probe.items():
+            self.hits_per_probe[probe] = self.hits_per_probe.get(probe, 0) + hits
+        self.settings.update(other.settings)
+        return self
+
+
+    def summary(self) -> Dict[str, Any]:
+        """Machine-readable summary of the run.
+
+        Returns:
+            (Dict[str, Any]): Sample, stages, settings like the Phred's offset, counters, reads scanned per
+                              second, share of the fragments rejected by the k-mer filter, hits per probe,
+                              and peak memory.
+        """
+        scanning: float = self.stages.get('scanning', {}).get('seconds', 0.0)
+        return {'sample': self.sample,
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'elapsed_seconds': time() - self.started,
+                'stages': self.stages,
+                **self.settings,
+                **self.counters,
+                'reads_per_second': self.counters['reads'] / scanning if scanning else 0.0,
+                'rejection_rate': (self.counters.get('rejected', 0) / self.counters['fragments']
+                                   if self.counters.get('fragments') else 0.0),
+                'hits_per_probe': dict(sorted(self.hits_per_probe.items())),
+                'peak_rss_bytes': max([span['peak_rss_bytes'] for span in self.stages.values()] + [peak_rss()])}
+
+
+    def write(self, path: str) -> str:
+        """Write the summary of the run as a JSON file.
+
+        Args:
+            path (str): Path of the JSON file.
+
+        Returns:
+            (str): Path of the file written.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2)
+        return path
+
+
+@contextmanager
+def profiled(profiler: Optional[str], output: str) -> Iterator[None]:
+    """Profile the block with cProfile, written to ``<output>.prof`` (for pstats or snakeviz), or with
+    pyinstrument, written to ``<output>.html``. Nothing is profiled when the profiler is None.
+
+    Args:
+        profiler (str): Profiler to use, any of cprofile and pyinstrument.
+        output (str): Path of the profile, without extension.
+
+    Returns:
+        (Iterator[None]): Profiled block.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f'Unknown profiler {profiler}, choose from {list(PROFILERS)}')
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(f'{output}.prof')
+        return
+
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        raise ImportError('pyinstrument is required to profile with it: pip install pyinstrument') from None
+    profile = Profiler()
+    profile.start()
+    try:
+        yield
+    finally:
+        profile.stop()
+        with open(f'{output}.html', 'w') as handle:
+            handle.write(profile.output_html())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+INDEX_VERSION: int = 3
+CACHE_DIR: str = '.liponium_cache'
+# The reference codon of a Gen-Position is the codon right after its probe, the other positions read other codons.
+REFERENCE_POSITION: int = 1
+
+
+def load_reference(reference_file: str) -> pd.DataFrame:
+    """Read the reference file keeping only the rows with probe and reference aminoacid.
+
+    Args:
+        reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+
+    Returns:
+        (pd.DataFrame): Reference data of each gen position.
+    """
+    import pandas as pd
+    reference: pd.DataFrame = pd.read_csv(reference_file)
+    reference.dropna(subset=['Probe', 'Reference Aminoacid'], inplace=True)
+    return reference
+
+
+def reference_lookup(reference: pd.DataFrame) -> pd.DataFrame:
+    """Index the reference data by Gen-Position, with one row per position, so the reference codon,
+    gen, and drug resistance of a position are a hash lookup instead of a scan of the table. Only the
+    first annotation row of a position is kept, the reports join all of them from the reference data.
+
+    Args:
+        reference (pd.DataFrame): Reference data of each gen position.
+
+    Returns:
+        (pd.DataFrame): Reference data indexed by Gen-Position.
+    """
+    lookup: pd.DataFrame = reference.drop_duplicates('Gen-Position').set_index('Gen-Position')
+    lookup['Reference Codon'] = lookup['Reference Codon'].fillna('')
+    return lookup
+
+
+def load_probes(file_name: str) -> pd.DataFrame:
+    """Read the csv with probes and positions, exploding the positions in one row per codon. The
+    repeated rows of the same Gen-Position, probe, and position are kept once, so their codons
+    are not counted twice.
+
+    Args:
+        file_name (str): Filename of the csv with probes and position to search.
+
+    Returns:
+        (pd.DataFrame): Gen-Position, Probe, and nucleotide position after the codon matching of each probe row.
+    """
+    import pandas as pd
+    file: pd.DataFrame = pd.read_csv(file_name)
+    file['Position'] = file['Position'].str.strip('[]')
+    file = file.assign(pos=file['Position'].str.split('-')).explode('pos')
+    file.dropna(inplace=True)
+    file.drop(columns='Position', inplace=True)
+    file.rename(columns={'pos': 'Position'}, inplace=True)
+    file['Position'] = file['Position'].astype(int)
+    file.drop_duplicates(['Gen-Position', 'Probe', 'Position'], inplace=True)
+    file.reset_index(drop=True, inplace=True)
+    return file
+
+
+def split_seeds(probe: str, mismatches: int = 1) -> List[Tuple[int, str]]:
+    """Split a probe in ``mismatches + 1`` non-overlapping seeds, so any variant with at most
+    ``mismatches`` substitutions keeps at least one seed intact (pigeonhole principle).
+
+    Args:
+        probe (str): Sequence of the probe.
+        mismatches (int): Maximum number of substitutions allowed between the probe and a read.
+
+    Returns:
+        (List[Tuple[int, str]]): Offset in the probe and sequence of each seed.
+    """
+    pieces: int = min(mismatches + 1, len(probe))
+    bounds: List[int] = [len(probe) * piece // pieces for piece in range(pieces + 1)]
+    return [(bounds[piece], probe[bounds[piece]:bounds[piece + 1]]) for piece in range(pieces)]
+
+
+class ProbeIndex:
+    """Compiled probe set: probe rows, codon offsets, gens, reference codons, and seeds of the probes,
+    kept as NumPy arrays that are cached on disk and loaded memory-mapped on later runs.
+    """
+    FIELDS: Tuple[str, ...] = ('gen_positions', 'row_probes', 'positions', 'genes', 'references',
+                               'probes', 'seeds', 'seed_probes', 'seed_offsets')
+
+    def __init__(self, arrays: Dict[str, np.ndarray], mismatches: int):
+        """Constructor for ProbeIndex class.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): Array of each field of the index.
+            mismatches (int): Maximum number of substitutions the seeds were split for.
+        """
+        self.mismatches: int = mismatches
+        self.gen_positions: np.ndarray = arrays['gen_positions']
+        self.row_probes: np.ndarray = arrays['row_probes']
+        self.positions: np.ndarray = arrays['positions']
+        self.genes: np.ndarray = arrays['genes']
+        self.references: np.ndarray = arrays['references']
+        self.probes: np.ndarray = arrays['probes']
+        self.seeds: np.ndarray = arrays['seeds']
+        self.seed_probes: np.ndarray = arrays['seed_probes']
+        self.seed_offsets: np.ndarray = arrays['seed_offsets']
+
+
+    @classmethod
+    def build(cls, probes_file: str, reference_file: str, mismatches: int = 1) -> 'ProbeIndex':
+        """Compile the probe index from the csv files.
+
+        Args:
+            probes_file (str): Filename of the csv with probes and position to search.
+            reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+            mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+
+        Returns:
+            (ProbeIndex): Compiled probe index.
+        """
+        file: pd.DataFrame = load_probes(probes_file)
+        lookup: pd.DataFrame = reference_lookup(load_reference(reference_file))
+        probes: List[str] = sorted(set(file['Probe']))
+        numbers: Dict[str, int] = {probe: number for number, probe in enumerate(probes)}
+        seeds: List[Tuple[str, int, int]] = [(seed, number, offset) for number, probe in enumerate(probes)
+                                             for offset, seed in split_seeds(probe, mismatches)]
+        return cls({'gen_positions': np.array(file['Gen-Position'].tolist(), dtype=bytes),
+                    'row_probes': np.array([numbers[probe] for probe in file['Probe']], dtype=np.int32),
+                    'positions': file['Position'].to_numpy(dtype=np.int32),
+                    'genes': np.array(file['Gen-Position'].map(lookup['Gen']).fillna('').tolist(), dtype=bytes),
+                    'references': np.array(file['Gen-Position'].map(lookup['Reference Codon']).fillna('').tolist(),
+                                           dtype='S3'),
+                    'probes': np.array(probes, dtype=bytes),
+                    'seeds': np.array([seed for seed, _, _ in seeds], dtype=bytes),
+                    'seed_probes': np.array([number for _, number, _ in seeds], dtype=np.int32),
+                    'seed_offsets': np.array([offset for _, _, offset in seeds], dtype=np.int32)}, mismatches)
+
+
+    @classmethod
+    def cached(cls, probes_file: str, reference_file: str, mismatches: int = 1,
+               cache_dir: str = CACHE_DIR) -> 'ProbeIndex':
+        """Load the probe index from the on-disk cache, compiling and saving it on the first run.
+        The cache is keyed by a hash of the csv files, so editing them compiles a new index.
+
+        Args:
+            probes_file (str): Filename of the csv with probes and position to search.
+            reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+            mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+            cache_dir (str): Folder of the cached indexes.
+
+        Returns:
+            (ProbeIndex): Compiled probe index, memory-mapped when it comes from the cache.
+        """
+        digest = hashlib.sha256(f'{INDEX_VERSION}:{mismatches}'.encode())
+        for file_name in (probes_file, reference_file):
+            with open(file_name, 'rb') as handle:
+                digest.update(handle.read())
+        directory: str = os.path.join(cache_dir, f'probes-{digest.hexdigest()[:16]}')
+
+        if os.path.isdir(directory):
+            return cls.load(directory, mismatches)
+        index: ProbeIndex = cls.build(probes_file, reference_file, mismatches)
+        index.save(directory)
+        return index
+
+
+    def save(self, directory: str) -> None:
+        """Write the arrays of the index in a folder, atomically.
+
+        Args:
+            directory (str): Folder of the index.
+        """
+        os.makedirs(os.path.dirname(directory) or '.', exist_ok=True)
+        staging: str = tempfile.mkdtemp(dir=os.path.dirname(directory) or '.')
+        for name in self.FIELDS:
+            np.save(os.path.join(staging, f'{name}.npy'), getattr(self, name))
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+    @classmethod
+    def load(cls, directory: str, mismatches: int = 1) -> 'ProbeIndex':
+        """Load the arrays of an index memory-mapped.
+
+        Args:
+            directory (str): Folder of the index.
+            mismatches (int): Maximum number of substitutions the seeds were split for.
+
+        Returns:
+            (ProbeIndex): Probe index.
+        """
+        return cls({name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in cls.FIELDS},
+                   mismatches)
+
+
+    def targets(self) -> Iterator[Tuple[int, str, int]]:
+        """Probe rows to count codons for.
+
+        Returns:
+            (Iterator[Tuple[int, str, int]]): Row, probe, and nucleotide position after the codon matching of each probe row.
+        """
+        probes: List[str] = [probe.decode() for probe in self.probes]
+        for row, (number, position) in enumerate(zip(self.row_probes, self.positions)):
+            yield row, probes[number], int(position)
+
+
+    def frame(self) -> pd.DataFrame:
+        """Probe rows as a dataframe.
+
+        Returns:
+            (pd.DataFrame): Gen, Gen-Position, Probe, Position, and Reference Codon of each probe row.
+        """
+        import pandas as pd
+        return pd.DataFrame({'Gen': np.char.decode(self.genes),
+                             'Gen-Position': np.char.decode(self.gen_positions),
+                             'Probe': np.char.decode(self.probes[self.row_probes]),
+                             'Position': np.asarray(self.positions),
+                             'Reference Codon': np.char.decode(self.references)})
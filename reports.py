@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import os
+from abc import ABC, abstractmethod
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Dict, List, Sequence, Type
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PARTITION_COLS: Sequence[str] = ('Sample', 'Gen')
+DEFAULT_PARTITION: str = '__HIVE_DEFAULT_PARTITION__'
+EXCEL_MAX_ROWS: int = 1048576
+
+
+class ReportWriter(ABC):
+    """Write the report tables under an output folder. The columnar writers write each table as a
+    ``<name>.<extension>`` dataset folder split in Hive-style partitions (``Sample=<sample>/Gen=<gen>/``),
+    so DuckDB, pyarrow or pandas can read a whole cohort as one dataset and prune the files by sample and gen.
+    """
+    extension: str = ''
+    partitioned: bool = True
+
+    def __init__(self, output: str, partition_cols: Sequence[str] = PARTITION_COLS):
+        """Constructor for ReportWriter class.
+
+        Args:
+            output (str): Folder of the reports.
+            partition_cols (Sequence[str]): Columns to partition the tables by, when present.
+        """
+        self.output: str = output
+        self.partition_cols: List[str] = list(partition_cols)
+
+
+    def write(self, name: str, df: pd.DataFrame) -> List[str]:
+        """Write a report table, one file per partition. Writing a partition again replaces it.
+
+        Args:
+            name (str): Name of the report.
+            df (pd.DataFrame): Report table.
+
+        Returns:
+            (List[str]): Paths of the files written.
+        """
+        if not self.partitioned:
+            os.makedirs(self.output, exist_ok=True)
+            path: str = os.path.join(self.output, f'{name}.{self.extension}')
+            self.write_file(df, path)
+            return [path]
+
+        dataset: str = os.path.join(self.output, f'{name}.{self.extension}')
+        columns: List[str] = [column for column in self.partition_cols if column in df.columns]
+        if not columns:
+            return [self.write_partition(df, dataset)]
+
+        keys: List[pd.Series] = [df[column].astype(str).replace({'': DEFAULT_PARTITION, 'nan': DEFAULT_PARTITION})
+                                 for column in columns]
+        paths: List[str] = []
+        for values, group in df.groupby(keys if len(keys) > 1 else keys[0], sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            partitions: List[str] = [f'{column}={value}' for column, value in zip(columns, values)]
+            paths.append(self.write_partition(group.drop(columns=columns), os.path.join(dataset, *partitions)))
+        return paths
+
+
+    def write_partition(self, df: pd.DataFrame, directory: str) -> str:
+        """Write the file of a partition.
+
+        Args:
+            df (pd.DataFrame): Rows of the partition.
+            directory (str): Folder of the partition.
+
+        Returns:
+            (str): Path of the file written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path: str = os.path.join(directory, f'part-0.{self.extension}')
+        self.write_file(df.reset_index(drop=True), path)
+        return path
+
+
+    @abstractmethod
+    def write_file(self, df: pd.DataFrame, path: str) -> None:
+        """Write a table in the format of the writer.
+
+        Args:
+            df (pd.DataFrame): Table to write.
+            path (str): Path of the file.
+        """
+
+
+class CsvWriter(ReportWriter):
+    """Partitioned csv reports."""
+    extension: str = 'csv'
+
+    def write_file(self, df: pd.DataFrame, path: str) -> None:
+        df.to_csv(path, index=False)
+
+
+class ParquetWriter(ReportWriter):
+    """Partitioned Parquet reports, it needs pyarrow."""
+    extension: str = 'parquet'
+
+    def write_file(self, df: pd.DataFrame, path: str) -> None:
+        require_pyarrow('parquet')
+        df.to_parquet(path, engine='pyarrow', index=False)
+
+
+class FeatherWriter(ReportWriter):
+    """Partitioned Arrow IPC (Feather) reports, it needs pyarrow."""
+    extension: str = 'feather'
+
+    def write_file(self, df: pd.DataFrame, path: str) -> None:
+        require_pyarrow('feather')
+        df.to_feather(path)
+
+
+class ExcelWriter(ReportWriter):
+    """Excel workbook per report, kept as an optional summary export. A sheet holds at most
+    1,048,576 rows, header included, so the larger tables are skipped with a warning instead
+    of failing at the end of a run; the columnar formats have them whole.
+    """
+    extension: str = 'xlsx'
+    partitioned: bool = False
+
+    def write(self, name: str, df: pd.DataFrame) -> List[str]:
+        if len(df) >= EXCEL_MAX_ROWS:
+            print(f'Warning: {name} has {len(df)} rows, more than an Excel sheet holds, it is not written as excel')
+            return []
+        return super().write(name, df)
+
+    def write_file(self, df: pd.DataFrame, path: str) -> None:
+        df.to_excel(path, index=False)
+
+
+WRITERS: Dict[str, Type[ReportWriter]] = {
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+    'feather': FeatherWriter,
+    'excel': ExcelWriter,
+}
+
+
+def require_pyarrow(report_format: str) -> None:
+    """Check that pyarrow is installed before writing an Arrow based report.
+
+    Args:
+        report_format (str): Name of the report format.
+    """
+    if find_spec('pyarrow') is None:
+        raise ImportError(f'pyarrow is required to write {report_format} reports: pip install pyarrow')
+
+
+def get_writers(formats: Sequence[str], output: str) -> List[ReportWriter]:
+    """Build the report writers of the requested formats.
+
+    Args:
+        formats (Sequence[str]): Report formats, any of csv, parquet, feather, and excel.
+        output (str): Folder of the reports.
+
+    Returns:
+        (List[ReportWriter]): Writer of each format.
+    """
+    unknown: List[str] = [report_format for report_format in formats if report_format not in WRITERS]
+    if unknown:
+        raise ValueError(f'Unknown report formats {unknown}, choose from {sorted(WRITERS)}')
+    return [WRITERS[report_format](output) for report_format in formats]
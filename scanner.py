@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+from itertools import islice
+from time import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+import numpy as np
+from fastq import Record, pair_fastq, read_fastq, zip_mates
+from metrics import RunMetrics
+from probes import ProbeIndex, split_seeds
+
+COMPLEMENT: dict = str.maketrans('ACGTN', 'TGCAN')
+BASE_COMPLEMENT: bytes = bytes.maketrans(b'ACGTN', b'TGCAN')
+BASE_CODES: np.ndarray = np.full(256, 4, dtype=np.uint8)
+BASE_CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+MAX_KMER: int = 11
+FILTER_BATCH: int = 4096
+
+
+class Hit(NamedTuple):
+    """A read where a probe (or one of its mismatch variants) was found."""
+    probe: str
+    read: bytes
+    quality: bytes
+    end: int
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """Build a regular expression alternation factorized as a prefix tree, so the regex
+    engine tests every seed at a position by walking the tree once instead of one seed at a time.
+
+    Args:
+        words (Iterable[str]): Literal words to match.
+
+    Returns:
+        (str): Regular expression that matches any of the words.
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node: dict) -> str:
+        branches: List[str] = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if '' in node:
+            branches.append('')
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')'
+
+    return build(trie)
+
+
+def reverse_complement(sequence: str) -> str:
+    """Reverse complement of a nucleotide sequence.
+
+    Args:
+        sequence (str): Nucleotide sequence.
+
+    Returns:
+        (str): Reverse complement of the sequence.
+    """
+    return sequence.translate(COMPLEMENT)[::-1]
+
+
+class KmerFilter:
+    """Bitset of the k-mers that start the seeds of the probes, that tells in bulk which reads of a
+    batch may hold a probe. A read within the allowed mismatches of a probe keeps one of its seeds
+    intact, so it holds the first k-mer of that seed and is never rejected; the off-target reads
+    are rejected with a few NumPy passes over the whole batch, without the regex.
+    """
+    def __init__(self, seeds: Iterable[str]):
+        """Constructor for KmerFilter class.
+
+        Args:
+            seeds (Iterable[str]): Seeds of the probes, in both strands.
+        """
+        seeds = list(seeds)
+        self.k: int = min([MAX_KMER] + [len(seed) for seed in seeds])
+        self.kmers: Optional[np.ndarray] = np.zeros(4 ** self.k, dtype=bool)
+        for seed in seeds:
+            codes: np.ndarray = BASE_CODES[np.frombuffer(seed[:self.k].encode(), dtype=np.uint8)]
+            if (codes > 3).any():
+                # A seed with other bases than ACGT can not be told apart, every read is a candidate.
+                self.kmers = None
+                return
+            self.kmers[int(codes.astype(np.int64) @ (4 ** np.arange(self.k - 1, -1, -1)))] = True
+
+
+    def candidates(self, reads: Sequence[bytes]) -> np.ndarray:
+        """Find the reads of a batch that hold the first k-mer of any seed.
+
+        Args:
+            reads (Sequence[bytes]): Sequences of the reads, as bytes or memoryviews of them.
+
+        Returns:
+            (np.ndarray): Mask of the reads that may hold a probe.
+        """
+        if self.kmers is None or not reads:
+            return np.ones(len(reads), dtype=bool)
+        # The reads are joined by a newline, that breaks the k-mers between them like any base other than ACGT.
+        codes: np.ndarray = BASE_CODES[np.frombuffer(b'\n'.join(reads), dtype=np.uint8)]
+        windows: int = len(codes) - self.k + 1
+        if windows <= 0:
+            return np.zeros(len(reads), dtype=bool)
+        bases: np.ndarray = (codes & 3).astype(np.uint32)
+        kmers: np.ndarray = np.zeros(windows, dtype=np.uint32)
+        for offset in range(self.k):
+            kmers <<= 2
+            kmers |= bases[offset:offset + windows]
+        others: np.ndarray = np.concatenate(([0], np.cumsum(codes > 3)))
+        found: np.ndarray = np.flatnonzero(self.kmers[kmers] & (others[self.k:] == others[:windows]))
+
+        lengths: np.ndarray = np.fromiter((len(read) + 1 for read in reads), dtype=np.int64, count=len(reads))
+        starts: np.ndarray = np.cumsum(lengths) - lengths
+        mask: np.ndarray = np.zeros(len(reads), dtype=bool)
+        mask[np.searchsorted(starts, found, side='right') - 1] = True
+        return mask
+
+
+class ProbeScanner:
+    """Match all the probes, and their mismatch variants, in a single pass over the fastq files.
+
+    Every probe is split in ``mismatches + 1`` seeds, so any variant with at most ``mismatches``
+    substitutions keeps at least one seed intact (pigeonhole principle). The seeds of all the
+    probes, and of their reverse complements, are compiled in one prefix-tree regex and each seed
+    hit is verified against the full probe. Reads from the opposite strand are reverse complemented
+    when found, so their codons are called in the forward frame. Before the regex, a k-mer filter of
+    the seeds rejects in batches the reads that can not hold any probe.
+    """
+    def __init__(self, probes: Iterable[str], mismatches: int = 1,
+                 seeds: Optional[Iterable[Tuple[str, int, int]]] = None, both_strands: bool = True,
+                 prefilter: bool = True):
+        """Constructor for ProbeScanner class.
+
+        Args:
+            probes (Iterable[str]): Sequences of the probes to seek in the reads.
+            mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+            seeds (Iterable[Tuple[str, int, int]]): Precompiled seed, probe number, and offset in the probe
+                                                    of each seed. The probes are then taken in the given order.
+            both_strands (bool): Seek also the reverse complement of the probes.
+            prefilter (bool): Reject the off-target reads with the k-mer filter before locating the probes.
+        """
+        self.probes: List[str] = list(probes) if seeds is not None else sorted(set(probes))
+        self.mismatches: int = mismatches
+        if seeds is None:
+            seeds = [(seed, index, offset) for index, probe in enumerate(self.probes)
+                     for offset, seed in split_seeds(probe, mismatches)]
+        seeds = list(seeds)
+
+        # Sequences to seek: the probes, followed by the reverse complement of the non-palindromic ones.
+        self.sequences: List[str] = list(self.probes)
+        self.strands: List[Tuple[int, bool]] = [(index, False) for index in range(len(self.probes))]
+        reverse: Dict[int, int] = {}
+        if both_strands:
+            forward = set(self.probes)
+            for index, probe in enumerate(self.probes):
+                if reverse_complement(probe) not in forward:
+                    reverse[index] = len(self.sequences)
+                    self.sequences.append(reverse_complement(probe))
+                    self.strands.append((index, True))
+
+        self.seeds: Dict[str, List[Tuple[int, int]]] = {}
+        for seed, index, offset in seeds:
+            self.seeds.setdefault(seed, []).append((index, offset))
+            if index in reverse:
+                rc_offset: int = len(self.probes[index]) - offset - len(seed)
+                self.seeds.setdefault(reverse_complement(seed), []).append((reverse[index], rc_offset))
+        # The regex reports the longest seed at each position, so each seed also targets the seeds that are its prefixes.
+        self.targets: Dict[bytes, List[Tuple[int, int]]] = {
+            seed.encode(): [hit for length in range(len(seed), 0, -1) for hit in self.seeds.get(seed[:length], [])]
+            for seed in self.seeds}
+        self.encoded: List[bytes] = [sequence.encode() for sequence in self.sequences]
+        self.pattern = re.compile(f'(?=({trie_pattern(self.seeds)}))'.encode())
+        self.prefilter: Optional[KmerFilter] = KmerFilter(self.seeds) if prefilter else None
+
+
+    @classmethod
+    def from_index(cls, index: ProbeIndex) -> 'ProbeScanner':
+        """Build the scanner from the probes and seeds of a compiled probe index.
+
+        Args:
+            index (ProbeIndex): Compiled probe index.
+
+        Returns:
+            (ProbeScanner): Scanner of the probes of the index.
+        """
+        return cls(np.char.decode(index.probes).tolist(), index.mismatches,
+                   zip(np.char.decode(index.seeds).tolist(), index.seed_probes.tolist(), index.seed_offsets.tolist()))
+
+
+    def locate(self, read: bytes) -> Dict[int, int]:
+        """Find the probes, in any strand, present in a read.
+
+        Args:
+            read (bytes): Sequence of the read, as bytes or a memoryview of them.
+
+        Returns:
+            (Dict[int, int]): Index of each sequence found and the read position where the sequence ends.
+        """
+        found: Dict[int, int] = {}
+        for match in self.pattern.finditer(read):
+            for index, offset in self.targets[match.group(1)]:
+                if index in found:
+                    continue
+                probe: bytes = self.encoded[index]
+                start: int = match.start() - offset
+                end: int = start + len(probe)
+                if start < 0 or end > len(read):
+                    continue
+                if sum(base != target for base, target in zip(read[start:end], probe)) <= self.mismatches:
+                    found[index] = end
+        return found
+
+
+    def fragment_hits(self, mates: Sequence[Record]) -> Dict[int, Hit]:
+        """Find the probes in the reads of a fragment, a single read or the mates of a pair, in the
+        forward frame. A probe found in more than one read (overlapping mates) is kept once, from
+        the read that extends the most after it, so each fragment is counted once per locus.
+
+        Args:
+            mates (Sequence[Record]): Sequence and Phred's quality of each read of the fragment.
+
+        Returns:
+            (Dict[int, Hit]): Hit of each probe number found.
+        """
+        hits: Dict[int, Hit] = {}
+        for read, quality in mates:
+            for index, end in self.locate(read).items():
+                probe, reverse = self.strands[index]
+                sequence: str = self.probes[probe]
+                if reverse:
+                    end = len(read) - end + len(sequence)
+                if probe in hits and len(hits[probe].read) - hits[probe].end >= len(read) - end:
+                    continue
+                if reverse:
+                    hits[probe] = Hit(sequence, read.tobytes().translate(BASE_COMPLEMENT)[::-1],
+                                      quality.tobytes()[::-1], end)
+                else:
+                    hits[probe] = Hit(sequence, read.tobytes(), quality.tobytes(), end)
+        return hits
+
+
+    def scan(self, files: Iterable[str], metrics: Optional[RunMetrics] = None, paired: bool = False,
+             dedup: bool = False) -> Iterator[Hit]:
+        """Read each fastq file once and yield the reads where any probe is found.
+
+        Args:
+            files (Iterable[str]): Paths of the fastq and fastq.gz files.
+            metrics (RunMetrics): Metrics of the run, that get the size on disk of the files (bytes_read), the
+                                  reads read, the decompression time, and the hits of each probe.
+            paired (bool): Read the _1 and _2 mates of the paired-end runs together, counting each
+                           fragment once per probe.
+            dedup (bool): Count once the fragments with the same sequences (PCR duplicates). Only the
+                          hashes of the fragments that match a probe are kept.
+
+        Returns:
+            (Iterator[Hit]): Probe, read, Phred's quality and probe end of each matching, in the forward frame.
+        """
+        seen: Set[int] = set()
+        for group in pair_fastq(list(files)) if paired else [(file_name,) for file_name in files]:
+            streams: List[Iterator[Record]] = []
+            for file_name in group:
+                records: Iterator[Record] = read_fastq(file_name)
+                if metrics is not None:
+                    metrics.add('bytes_read', os.path.getsize(file_name))
+                    records = metrics.timed('decompression', records)
+                streams.append(records)
+
+            yield from self.scan_fragments(zip_mates(streams, group), metrics, seen if dedup else None)
+
+
+    def scan_fragments(self, fragments: Iterable[Tuple[Record, ...]], metrics: Optional[RunMetrics] = None,
+                       seen: Optional[Set[int]] = None) -> Iterator[Hit]:
+        """Yield the hits of a stream of fragments, each one a single read or the mates of a pair.
+        The fragments are read in batches, and only the ones with a read passing the k-mer filter
+        are located.
+
+        Args:
+            fragments (Iterable[Tuple[Record, ...]]): Sequence and Phred's quality of the reads of each fragment.
+            metrics (RunMetrics): Metrics of the run, that get the hits of each probe, the duplicates, and
+                                  the fragments rejected by the k-mer filter.
+            seen (Set[int]): Hashes of the fragments already counted, to skip their duplicates. None to count them all.
+
+        Returns:
+            (Iterator[Hit]): Probe, read, Phred's quality and probe end of each matching, in the forward frame.
+        """
+        for mates in self.filtered(fragments, metrics):
+            hits: Dict[int, Hit] = self.fragment_hits(mates)
+            if not hits:
+                continue
+            if seen is not None:
+                fragment: int = hash(tuple(read.tobytes() for read, _ in mates))
+                if fragment in seen:
+                    if metrics is not None:
+                        metrics.add('duplicates')
+                    continue
+                seen.add(fragment)
+            for hit in hits.values():
+                if metrics is not None:
+                    metrics.hit(hit.probe)
+                yield hit
+
+
+    def filtered(self, fragments: Iterable[Tuple[Record, ...]],
+                 metrics: Optional[RunMetrics] = None) -> Iterator[Tuple[Record, ...]]:
+        """Drop the fragments where no read holds a k-mer of the seeds, a batch at a time.
+
+        Args:
+            fragments (Iterable[Tuple[Record, ...]]): Sequence and Phred's quality of the reads of each fragment.
+            metrics (RunMetrics): Metrics of the run, that get the fragments filtered and rejected, and the filter time.
+
+        Returns:
+            (Iterator[Tuple[Record, ...]]): Fragments that may hold a probe.
+        """
+        if self.prefilter is None:
+            yield from fragments
+            return
+        iterator: Iterator[Tuple[Record, ...]] = iter(fragments)
+        while True:
+            batch: List[Tuple[Record, ...]] = list(islice(iterator, FILTER_BATCH))
+            if not batch:
+                return
+            start = time()
+            owners: np.ndarray = np.repeat(np.arange(len(batch)), [len(mates) for mates in batch])
+            passed: np.ndarray = np.zeros(len(batch), dtype=bool)
+            passed[owners[self.prefilter.candidates([read for mates in batch for read, _ in mates])]] = True
+            if metrics is not None:
+                metrics.record('prefilter', time() - start)
+                metrics.add('fragments', len(batch))
+                metrics.add('rejected', len(batch) - int(passed.sum()))
+            for number in np.flatnonzero(passed):
+                yield batch[number]
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import mmap
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+from typing import Iterator, List, Optional, Sequence, Tuple
+from codons import CodonCounter, QualityModel
+from fastq import BUFFER_SIZE, Record, open_fastq, parse_fastq
+from metrics import RunMetrics
+from scanner import ProbeScanner
+
+Shard = Tuple[str, int, int]
+
+
+class RangeReader:
+    """Binary reader of a byte range of a memory-mapped file, so a shard is parsed as a fastq stream."""
+    def __init__(self, buffer: mmap.mmap, begin: int, end: int):
+        """Constructor for RangeReader class.
+
+        Args:
+            buffer (mmap.mmap): Memory-mapped fastq file.
+            begin (int): First byte of the range.
+            end (int): Byte after the range.
+        """
+        self.buffer: mmap.mmap = buffer
+        self.position: int = begin
+        self.end: int = end
+
+
+    def read(self, size: int = -1) -> bytes:
+        stop: int = self.end if size < 0 else min(self.position + size, self.end)
+        block: bytes = self.buffer[self.position:stop]
+        self.position = stop
+        return block
+
+
+def record_start(buffer: mmap.mmap, offset: int) -> int:
+    """First record starting at or after an offset of a fastq file. A record starts at a line with
+    '@' whose second next line starts with '+'; a quality line starting with '@' is followed by a
+    header and a sequence instead, so it is never taken for a record.
+
+    Args:
+        buffer (mmap.mmap): Memory-mapped fastq file.
+        offset (int): Offset to search from.
+
+    Returns:
+        (int): Offset of the record, or the size of the file if there is none.
+    """
+    if offset <= 0:
+        return 0
+    line: int = buffer.find(b'\n', offset - 1) + 1
+    while 0 < line < len(buffer):
+        if buffer[line:line + 1] == b'@':
+            sequence: int = buffer.find(b'\n', line) + 1
+            plus: int = buffer.find(b'\n', sequence) + 1 if sequence else 0
+            if plus and buffer[plus:plus + 1] == b'+':
+                return line
+        line = buffer.find(b'\n', line) + 1
+    return len(buffer)
+
+
+def shard_ranges(file_name: str, shards: int) -> List[Shard]:
+    """Split an uncompressed fastq file in record-aligned byte ranges of about the same size.
+
+    Args:
+        file_name (str): Path of the fastq file.
+        shards (int): Number of ranges.
+
+    Returns:
+        (List[Shard]): File, first byte, and byte after each range.
+    """
+    size: int = os.path.getsize(file_name)
+    if not size:
+        return []
+    with open(file_name, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        bounds: List[int] = sorted({record_start(buffer, size * shard // shards) for shard in range(shards)} | {size})
+    return [(file_name, begin, end) for begin, end in zip(bounds, bounds[1:])]
+
+
+def decompress_fastq(file_name: str, directory: str) -> str:
+    """Decompress a fastq.gz file once in a scratch folder, so it can be memory-mapped and sharded.
+
+    Args:
+        file_name (str): Path of the fastq.gz file.
+        directory (str): Scratch folder.
+
+    Returns:
+        (str): Path of the decompressed fastq file.
+    """
+    path: str = os.path.join(directory, os.path.basename(file_name)[:-3])
+    with open_fastq(file_name) as source, open(path, 'wb') as target:
+        shutil.copyfileobj(source, target, BUFFER_SIZE)
+    return path
+
+
+class ShardWorker:
+    """Scanner and probe rows of a shard worker process, built once and reused for all its shards."""
+    def __init__(self, probes: List[str], mismatches: int, targets: List[Tuple[int, str, int]],
+                 quality: QualityModel = QualityModel()):
+        """Constructor for ShardWorker class.
+
+        Args:
+            probes (List[str]): Sequences of the probes.
+            mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+            targets (List[Tuple[int, str, int]]): Row, probe, and nucleotide position after the codon matching of each probe row.
+            quality (QualityModel): Phred's quality filter of the codons.
+        """
+        self.scanner: ProbeScanner = ProbeScanner(probes, mismatches)
+        self.targets: List[Tuple[int, str, int]] = targets
+        self.quality: QualityModel = quality
+
+
+    def count(self, shard: Shard) -> Tuple[CodonCounter, RunMetrics]:
+        """Count the codons of the reads of a shard, parsed straight from the memory-mapped file.
+
+        Args:
+            shard (Shard): File, first byte, and byte after the range.
+
+        Returns:
+            (Tuple[CodonCounter, RunMetrics]): Codon counter and metrics of the shard.
+        """
+        file_name, begin, end = shard
+        metrics = RunMetrics()
+        counter = CodonCounter(self.targets, quality=self.quality)
+        with open(file_name, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            records: Iterator[Record] = metrics.timed('decompression', parse_fastq(RangeReader(buffer, begin, end)))
+            with metrics.span('shard scanning'):
+                counter.update(self.scanner.scan_fragments(((record,) for record in records), metrics))
+        metrics.add('bytes_sharded', end - begin)
+        return counter, metrics
+
+
+shard_worker: Optional[ShardWorker] = None
+
+
+def init_shard_worker(probes: List[str], mismatches: int, targets: List[Tuple[int, str, int]],
+                      quality: QualityModel = QualityModel()) -> None:
+    """Build the scanner of the shard worker process.
+
+    Args:
+        probes (List[str]): Sequences of the probes.
+        mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+        targets (List[Tuple[int, str, int]]): Row, probe, and nucleotide position after the codon matching of each probe row.
+        quality (QualityModel): Phred's quality filter of the codons.
+    """
+    global shard_worker
+    shard_worker = ShardWorker(probes, mismatches, targets, quality)
+
+
+def count_shard(shard: Shard) -> Tuple[CodonCounter, RunMetrics]:
+    """Count the codons of a shard in the worker process.
+
+    Args:
+        shard (Shard): File, first byte, and byte after the range.
+
+    Returns:
+        (Tuple[CodonCounter, RunMetrics]): Codon counter and metrics of the shard.
+    """
+    return shard_worker.count(shard)
+
+
+def count_sharded(targets: Sequence[Tuple[int, str, int]], mismatches: int, files: Sequence[str],
+                  workers: Optional[int] = None, metrics: Optional[RunMetrics] = None,
+                  shards_per_worker: int = 4, scratch: Optional[str] = None,
+                  quality: QualityModel = QualityModel()) -> CodonCounter:
+    """Count the codons of the probe rows in a sample splitting its fastq files in record-aligned
+    byte ranges, scanned in parallel by a pool of worker processes over the memory-mapped files
+    (shared through the page cache). The fastq.gz files are decompressed once in a scratch folder
+    first. The counters of the shards are merged in file order, so the counts and the example reads
+    are the same as scanning the files one after the other.
+
+    Args:
+        targets (Sequence[Tuple[int, str, int]]): Row, probe, and nucleotide position after the codon matching of each probe row.
+        mismatches (int): Maximum number of substitutions allowed between a probe and a read.
+        files (Sequence[str]): Fastq and fastq.gz files of the sample.
+        workers (int): Number of worker processes, all the CPUs by default.
+        metrics (RunMetrics): Metrics of the run, that get the merged metrics of the shards, with the
+                              CPU seconds of the workers in the shard scanning stage, the size on disk
+                              of the files (bytes_read), and the decompressed bytes of the shards (bytes_sharded).
+        shards_per_worker (int): Ranges of each file per worker, more ranges balance better the load.
+        scratch (str): Folder to decompress the fastq.gz files, the temporal folder by default.
+        quality (QualityModel): Phred's quality filter of the codons, its offset is detected from the files if not set.
+
+    Returns:
+        (CodonCounter): Merged codon counter of all the shards.
+    """
+    targets = list(targets)
+    workers = workers or os.cpu_count() or 1
+    metrics = metrics if metrics is not None else RunMetrics()
+    quality = quality.resolve(files)
+    counter = CodonCounter(targets, quality=quality)
+    for file_name in files:
+        metrics.add('bytes_read', os.path.getsize(file_name))
+    with tempfile.TemporaryDirectory(dir=scratch) as directory:
+        with metrics.span('decompression'):
+            plain: List[str] = [decompress_fastq(file_name, directory) if file_name.endswith('.gz') else file_name
+                                for file_name in files]
+        shards: List[Shard] = [shard for file_name in plain for shard in shard_ranges(file_name, workers * shards_per_worker)]
+        probes: List[str] = sorted({probe for _, probe, _ in targets})
+        with Pool(workers, initializer=init_shard_worker, initargs=(probes, mismatches, targets, quality)) as pool:
+            for shard_counter, shard_metrics in pool.imap(count_shard, shards):
+                counter.merge(shard_counter)
+                metrics.merge(shard_metrics)
+    return counter
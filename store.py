@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS samples (
+    Sample TEXT NOT NULL,
+    Config TEXT NOT NULL,
+    Status TEXT NOT NULL,
+    Files TEXT,
+    Updated TEXT,
+    Summary TEXT,
+    Error TEXT,
+    PRIMARY KEY (Sample, Config)
+);
+CREATE TABLE IF NOT EXISTS codons (
+    Sample TEXT NOT NULL,
+    Config TEXT NOT NULL,
+    Gen TEXT,
+    "Gen-Position" TEXT,
+    Position INTEGER,
+    "Mutated Codon" TEXT,
+    "Reference Codon" TEXT,
+    Counts INTEGER,
+    Frequencies REAL,
+    "Raw Counts" INTEGER
+);
+CREATE INDEX IF NOT EXISTS codons_sample ON codons (Sample, Config);
+CREATE INDEX IF NOT EXISTS codons_position ON codons ("Gen-Position");
+'''
+CODON_COLUMNS: Sequence[str] = ('Sample', 'Gen', 'Gen-Position', 'Position', 'Mutated Codon', 'Reference Codon',
+                                'Counts', 'Frequencies', 'Raw Counts')
+
+
+def config_key(probes_file: str, reference_file: str, **options: Any) -> str:
+    """Key of the configuration of a run, the probe set and the counting options, so the samples
+    are processed again when any of them changes.
+
+    Args:
+        probes_file (str): Filename of the csv with probes and position to search.
+        reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+        options (Any): Counting options of the run.
+
+    Returns:
+        (str): Key of the configuration.
+    """
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode())
+    for file_name in (probes_file, reference_file):
+        with open(file_name, 'rb') as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()[:16]
+
+
+class ResultStore:
+    """Durable SQLite store of the codon counts of each processed sample. Each sample is recorded
+    in one transaction with its counts and run summary, so a killed run leaves it complete or
+    absent, a restarted run skips the finished samples, and the counts of many runs can be queried
+    with SQL without scanning the fastq files again.
+    """
+    def __init__(self, path: str):
+        """Constructor for ResultStore class.
+
+        Args:
+            path (str): Path of the SQLite database, created if it does not exist.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path: str = path
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        columns: Set[str] = {column for _, column, *_ in self.connection.execute('PRAGMA table_info(codons)')}
+        if 'Raw Counts' not in columns:
+            self.connection.execute('ALTER TABLE codons ADD COLUMN "Raw Counts" INTEGER')
+
+
+    def __enter__(self) -> 'ResultStore':
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+
+    def finished(self, config: str) -> Set[str]:
+        """Samples already processed with a configuration.
+
+        Args:
+            config (str): Key of the configuration.
+
+        Returns:
+            (Set[str]): Names of the finished samples.
+        """
+        rows = self.connection.execute("SELECT Sample FROM samples WHERE Config = ? AND Status = 'finished'", (config,))
+        return {sample for sample, in rows}
+
+
+    def save(self, sample: str, config: str, files: Sequence[str], table: pd.DataFrame,
+             summary: Optional[Dict[str, Any]] = None) -> None:
+        """Record a finished sample with its codon counts, replacing any earlier record, atomically.
+
+        Args:
+            sample (str): Name of the sample.
+            config (str): Key of the configuration.
+            files (Sequence[str]): Fastq and fastq.gz files of the sample.
+            table (pd.DataFrame): Codon counts and frequencies of the sample.
+            summary (Dict[str, Any]): Run summary of the sample.
+        """
+        rows: List[tuple] = [(sample, config, *row) for row in
+                             table.reindex(columns=CODON_COLUMNS[1:]).astype(object).where(table.notna(), None)
+                             .itertuples(index=False, name=None)]
+        columns: str = ', '.join(f'"{column}"' for column in ('Sample', 'Config', *CODON_COLUMNS[1:]))
+        with self.connection:
+            self.connection.execute('DELETE FROM codons WHERE Sample = ? AND Config = ?', (sample, config))
+            self.connection.executemany(f'INSERT INTO codons ({columns}) VALUES ({", ".join("?" * (len(CODON_COLUMNS) + 1))})',
+                                        rows)
+            self.connection.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (sample, config, 'finished', json.dumps(list(files)), datetime.now().isoformat(),
+                                     json.dumps(summary) if summary is not None else None, None))
+
+
+    def fail(self, sample: str, config: str, files: Sequence[str], error: str) -> None:
+        """Record a sample that failed, and drop the codon counts of any earlier run of it, so the
+        store only holds the counts of finished samples. It is processed again on the next run.
+
+        Args:
+            sample (str): Name of the sample.
+            config (str): Key of the configuration.
+            files (Sequence[str]): Fastq and fastq.gz files of the sample.
+            error (str): Error raised processing the sample.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM codons WHERE Sample = ? AND Config = ?', (sample, config))
+            self.connection.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (sample, config, 'failed', json.dumps(list(files)), datetime.now().isoformat(),
+                                     None, error))
+
+
+    def codons(self, samples: Optional[Sequence[str]] = None, config: Optional[str] = None) -> pd.DataFrame:
+        """Codon counts of the finished samples, of all of them or only some. The samples chosen are
+        joined from a temporary table, so their number is not bound by the SQLite variable limit.
+
+        Args:
+            samples (Sequence[str]): Names of the samples, all of them by default.
+            config (str): Key of the configuration, all of them by default.
+
+        Returns:
+            (pd.DataFrame): Codon counts and frequencies of the samples.
+        """
+        import pandas as pd
+        query: str = ('SELECT ' + ', '.join(f'codons."{column}"' for column in CODON_COLUMNS) + ' FROM codons '
+                      'JOIN samples ON samples.Sample = codons.Sample AND samples.Config = codons.Config '
+                      "WHERE samples.Status = 'finished'")
+        parameters: List[str] = []
+        if config is not None:
+            query += ' AND codons.Config = ?'
+            parameters.append(config)
+        if samples is None:
+            return pd.read_sql_query(query, self.connection, params=parameters)
+
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS chosen (Sample TEXT PRIMARY KEY)')
+        try:
+            self.connection.executemany('INSERT OR IGNORE INTO temp.chosen VALUES (?)', ((sample,) for sample in samples))
+            return pd.read_sql_query(query + ' AND codons.Sample IN (SELECT Sample FROM temp.chosen)',
+                                     self.connection, params=parameters)
+        finally:
+            self.connection.execute('DELETE FROM temp.chosen')
+            self.connection.commit()
+
+
+    def iter_counts(self, config: str, size: int = 100000) -> Iterator[List[Tuple[str, str, int, str, int]]]:
+        """Codon counts of the finished samples of a configuration, streamed in chunks of rows, so a
+        whole cohort is read without loading it in memory.
+
+        Args:
+            config (str): Key of the configuration.
+            size (int): Rows of each chunk.
+
+        Returns:
+            (Iterator[List[Tuple[str, str, int, str, int]]]): Sample, Gen-Position, Position, mutated codon,
+                                                              and counts of each codon row.
+        """
+        cursor: sqlite3.Cursor = self.connection.execute(
+            'SELECT codons.Sample, "Gen-Position", Position, "Mutated Codon", Counts FROM codons '
+            "JOIN samples ON samples.Sample = codons.Sample AND samples.Config = codons.Config "
+            "WHERE codons.Config = ? AND Status = 'finished'", (config,))
+        while True:
+            rows: List[Tuple[str, str, int, str, int]] = cursor.fetchmany(size)
+            if not rows:
+                return
+            yield rows
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from codons import CODON_CODES, CODONS, OTHER_CODON
+from probes import REFERENCE_POSITION, ProbeIndex, load_reference, reference_lookup
+from store import ResultStore
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+LOCUS_FIELDS: Sequence[str] = ('Gen', 'Gen-Position', 'Position', 'Reference Codon', 'Drug Resistance')
+
+
+class CohortMatrix:
+    """Codon counts of a cohort as a memory-mapped samples x loci x codons matrix, where a locus is a
+    codon position of a Gen-Position and the codons are the 64 codons and NNN. The allele frequencies
+    are normalized per sample and locus, and the queries read the matrix in blocks of samples, so
+    their memory does not grow with the size of the cohort. The reference codon of a Gen-Position
+    only belongs to its first codon position, so the variants are called at that locus only.
+    """
+    def __init__(self, directory: str):
+        """Constructor for CohortMatrix class.
+
+        Args:
+            directory (str): Folder of the matrix, written by CohortMatrix.build.
+        """
+        with open(os.path.join(directory, 'matrix.json')) as handle:
+            meta: Dict[str, list] = json.load(handle)
+        self.directory: str = directory
+        self.samples: List[str] = meta['samples']
+        self.loci: Dict[str, list] = {field: meta[field] for field in LOCUS_FIELDS}
+        self.references: np.ndarray = np.array([CODON_CODES.get(codon, -1) if position == REFERENCE_POSITION else -1
+                                                for codon, position in zip(self.loci['Reference Codon'],
+                                                                           self.loci['Position'])], dtype=np.int64)
+        self.counts: np.ndarray = np.load(os.path.join(directory, 'counts.npy'), mmap_mode='r')
+
+
+    @classmethod
+    def build(cls, store: ResultStore, config: str, probes_file: str, reference_file: str, directory: str,
+              samples: Optional[Sequence[str]] = None) -> 'CohortMatrix':
+        """Write the matrix of the samples finished in the result store, streaming their codon counts
+        in chunks. The counts of the probe rows of the same locus are added.
+
+        Args:
+            store (ResultStore): Result store of the cohort.
+            config (str): Key of the configuration of the counts.
+            probes_file (str): Filename of the csv with probes and position to search.
+            reference_file (str): Input file that contains genes, probes, positions, and reference codons.
+            directory (str): Folder of the matrix, replaced if it exists.
+            samples (Sequence[str]): Samples of the matrix, all the finished ones by default.
+
+        Returns:
+            (CohortMatrix): Matrix of the cohort, memory-mapped.
+        """
+        finished: Set[str] = store.finished(config)
+        samples = sorted(finished) if samples is None else [sample for sample in samples if sample in finished]
+        loci: pd.DataFrame = ProbeIndex.cached(probes_file, reference_file).frame()
+        loci = loci.drop_duplicates(['Gen-Position', 'Position']).sort_values(['Gen-Position', 'Position'])
+        lookup: pd.DataFrame = reference_lookup(load_reference(reference_file))
+        loci['Drug Resistance'] = loci['Gen-Position'].map(lookup['Drug Resistance']).fillna('')
+
+        os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+        staging: str = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(directory)))
+        counts: np.ndarray = np.lib.format.open_memmap(os.path.join(staging, 'counts.npy'), mode='w+', dtype=np.uint32,
+                                                       shape=(len(samples), len(loci), len(CODONS)))
+        sample_ids: Dict[str, int] = {sample: number for number, sample in enumerate(samples)}
+        locus_ids: Dict[Tuple[str, int], int] = {(gen_position, int(position)): number for number, (gen_position, position)
+                                                 in enumerate(zip(loci['Gen-Position'], loci['Position']))}
+        for rows in store.iter_counts(config):
+            cells: np.ndarray = np.array([(sample_ids.get(sample, -1), locus_ids.get((gen_position, position), -1),
+                                           CODON_CODES.get(codon, OTHER_CODON), count)
+                                          for sample, gen_position, position, codon, count in rows],
+                                         dtype=np.int64).reshape(-1, 4)
+            cells = cells[(cells[:, 0] >= 0) & (cells[:, 1] >= 0)]
+            np.add.at(counts, (cells[:, 0], cells[:, 1], cells[:, 2]), cells[:, 3].astype(np.uint32))
+        counts.flush()
+        del counts
+
+        with open(os.path.join(staging, 'matrix.json'), 'w') as handle:
+            json.dump({'samples': list(samples), **{field: loci[field].tolist() for field in LOCUS_FIELDS}}, handle)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(staging, directory)
+        return cls(directory)
+
+
+    def blocks(self, chunk_size: int = 256) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """Allele frequencies of the cohort, a block of samples at a time.
+
+        Args:
+            chunk_size (int): Samples of each block.
+
+        Returns:
+            (Iterator[Tuple[int, np.ndarray, np.ndarray]]): First sample of the block, percent frequency of
+                                                            each sample, locus, and codon, and depth of each
+                                                            sample and locus.
+        """
+        for start in range(0, len(self.samples), chunk_size):
+            block: np.ndarray = np.asarray(self.counts[start:start + chunk_size], dtype=np.float64)
+            depths: np.ndarray = block.sum(axis=2)
+            frequencies: np.ndarray = np.divide(block * 100, depths[..., None], out=np.zeros_like(block),
+                                                where=depths[..., None] > 0)
+            yield start, frequencies, depths
+
+
+    def alternative(self) -> np.ndarray:
+        """Mask of the codons of each locus that differ from its reference codon, without NNN, and
+        without any codon in the loci with no reference codon.
+
+        Returns:
+            (np.ndarray): Loci x codons mask.
+        """
+        codes: np.ndarray = np.arange(len(CODONS))
+        return ((codes[None, :] != self.references[:, None]) & (codes[None, :] != OTHER_CODON)
+                & (self.references[:, None] >= 0))
+
+
+    def minor_variants(self, minimum: float = 1.0, maximum: float = 95.0, min_depth: int = 10,
+                       chunk_size: int = 256) -> pd.DataFrame:
+        """Codons other than the reference found in a sample at a minor frequency, the signal of heteroresistance.
+
+        Args:
+            minimum (float): Lowest percent frequency of a minor variant.
+            maximum (float): Percent frequency from which a variant is fixed instead of minor.
+            min_depth (int): Lowest depth of a locus to call its variants.
+            chunk_size (int): Samples read from the matrix at a time.
+
+        Returns:
+            (pd.DataFrame): Sample, locus, mutated codon, frequency, and depth of each minor variant.
+        """
+        import pandas as pd
+        alternative: np.ndarray = self.alternative()
+        found: List[Tuple[np.ndarray, ...]] = []
+        for start, frequencies, depths in self.blocks(chunk_size):
+            minor: np.ndarray = ((frequencies >= minimum) & (frequencies < maximum) & alternative[None]
+                                 & (depths >= min_depth)[..., None])
+            samples, loci, codes = np.nonzero(minor)
+            found.append((samples + start, loci, codes, frequencies[samples, loci, codes], depths[samples, loci]))
+        columns: List[np.ndarray] = ([np.concatenate(column) for column in zip(*found)] if found
+                                     else [np.empty(0, dtype=np.int64)] * 5)
+        samples, loci, codes, frequencies, depths = columns
+
+        variants: pd.DataFrame = pd.DataFrame({'Sample': np.array(self.samples, dtype=object)[samples]})
+        for field in LOCUS_FIELDS[:4]:
+            variants[field] = np.array(self.loci[field], dtype=object)[loci]
+        variants['Mutated Codon'] = CODONS[codes]
+        variants['Frequencies'] = frequencies
+        variants['Depth'] = depths.astype(np.int64)
+        variants['Drug Resistance'] = np.array(self.loci['Drug Resistance'], dtype=object)[loci]
+        return variants
+
+
+    def resistance_summary(self, minimum: float = 1.0, fixed: float = 95.0, min_depth: int = 10,
+                           chunk_size: int = 256) -> pd.DataFrame:
+        """Samples resistant and heteroresistant to each Drug Resistance class. The alternative frequency
+        of a locus is the one of all its codons other than the reference; a sample is resistant when it
+        reaches the fixed frequency at any locus of the class, and heteroresistant when it is not
+        resistant but reaches the minimum frequency at any of them. The loci with no Drug Resistance
+        class are left out.
+
+        Args:
+            minimum (float): Lowest alternative percent frequency of a heteroresistant locus.
+            fixed (float): Alternative percent frequency of a resistant locus.
+            min_depth (int): Lowest depth of a locus to take it into account.
+            chunk_size (int): Samples read from the matrix at a time.
+
+        Returns:
+            (pd.DataFrame): Loci with a reference codon, samples covered, resistant, and heteroresistant
+                            samples of each Drug Resistance class.
+        """
+        import pandas as pd
+        alternative: np.ndarray = self.alternative()
+        drugs: np.ndarray = np.array(self.loci['Drug Resistance'], dtype=object)
+        classes: List[str] = sorted(set(drugs) - {''})
+        members: np.ndarray = np.array([drugs == drug for drug in classes]).reshape(len(classes), len(drugs))
+        totals: np.ndarray = np.zeros((3, len(classes)), dtype=np.int64)
+        for _, frequencies, depths in self.blocks(chunk_size):
+            covered: np.ndarray = (depths >= min_depth) & (self.references >= 0)[None]
+            frequency: np.ndarray = (frequencies * alternative[None]).sum(axis=2)
+            resistant: np.ndarray = covered & (frequency >= fixed)
+            partial: np.ndarray = covered & (frequency >= minimum) & (frequency < fixed)
+            any_covered, any_resistant, any_partial = (mask.astype(np.int64) @ members.T.astype(np.int64) > 0
+                                                       for mask in (covered, resistant, partial))
+            totals += np.array([any_covered.sum(axis=0), any_resistant.sum(axis=0),
+                                (any_partial & ~any_resistant).sum(axis=0)]).reshape(3, len(classes))
+
+        return pd.DataFrame({'Drug Resistance': classes,
+                             'Loci': (members & (self.references >= 0)[None]).sum(axis=1),
+                             'Samples': totals[0],
+                             'Resistant': totals[1],
+                             'Heteroresistant': totals[2]})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Liponium cohort summary: minor variants and drug resistance.')
+    parser.add_argument('matrix', help='Folder of the cohort matrix, <output>/Cohort_Matrix of cohort.py')
+    parser.add_argument('--minor-frequency', type=float, default=1.0, help='Lowest percent frequency of a minor variant')
+    parser.add_argument('--fixed-frequency', type=float, default=95.0, help='Percent frequency of a fixed variant')
+    parser.add_argument('--min-depth', type=int, default=10, help='Lowest depth of a locus to call its variants')
+    parser.add_argument('--variants', default=None, help='Csv to write the minor variants of every sample')
+    args = parser.parse_args()
+
+    matrix = CohortMatrix(args.matrix)
+    print(matrix.resistance_summary(args.minor_frequency, args.fixed_frequency, args.min_depth).to_string(index=False))
+    if args.variants is not None:
+        matrix.minor_variants(args.minor_frequency, args.fixed_frequency, args.min_depth).to_csv(args.variants, index=False)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import io
+from typing import List, Tuple
+import pytest
+from fastq import parse_fastq
+
+RECORDS: bytes = (b'@r1\nACGTACGT\n+\nIIIIIIII\n'
+                  b'@r2\n\n+\n\n'
+                  b'@r3 length=4\nGGGG\n+r3\nJJJJ\n'
+                  b'\n'
+                  b'@r4\n\n+\n\n'
+                  b'@r5\nTTTTT\n+\n@@@@@\n')
+EXPECTED: List[Tuple[bytes, bytes]] = [(b'ACGTACGT', b'IIIIIIII'), (b'', b''), (b'GGGG', b'JJJJ'), (b'', b''),
+                                       (b'TTTTT', b'@@@@@')]
+
+
+def parse(data: bytes, buffer_size: int = 1 << 20) -> List[Tuple[bytes, bytes]]:
+    """Parse fastq data in blocks of the given size.
+
+    Args:
+        data (bytes): Fastq data.
+        buffer_size (int): Bytes read in each block.
+
+    Returns:
+        (List[Tuple[bytes, bytes]]): Sequence and Phred's quality of each read.
+    """
+    return [(sequence.tobytes(), quality.tobytes()) for sequence, quality in parse_fastq(io.BytesIO(data), buffer_size)]
+
+
+def test_empty_reads():
+    assert parse(RECORDS) == EXPECTED
+
+
+def test_crlf_line_ends():
+    assert parse(RECORDS.replace(b'\n', b'\r\n')) == EXPECTED
+
+
+def test_records_across_blocks():
+    for data in (RECORDS, RECORDS.replace(b'\n', b'\r\n'), RECORDS[:-1]):
+        for buffer_size in range(1, len(data) + 2):
+            assert parse(data, buffer_size) == EXPECTED
+
+
+@pytest.mark.parametrize('data', [b'hello\nworld\nfoo\nbar\n',
+                                  b'@r1\nACGT\n-\nIIII\n',
+                                  b'@r1\nACGT\n+\nIII\n',
+                                  b'@r1\nACGT\n+\nIIII\n@r2\n\n+\n@r3\nGG\n+\nJJ\n',
+                                  b'@r1\nACGT\n+\nIIII\n@r2\nGG\n'])
+def test_malformed_records(data: bytes):
+    with pytest.raises(ValueError):
+        parse(data)
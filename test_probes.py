@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from probes import load_probes
+
+
+def test_repeated_probe_rows(tmp_path):
+    probes = tmp_path / 'probes.csv'
+    probes.write_text('Gen-Position,Probe,Position\n'
+                      'gyrA-261,TGGGCAACTACCACCCGCAC,1\n'
+                      'gyrA-261,TGGGCAACTACCACCCGCAC,1\n'
+                      'pncA-168,TCCACATCGACCCGGGTGAC,1\n'
+                      'pncA-168,TCCACATCGACCCGGGTGAC,1-3-6\n'
+                      'rpoB-1305,AGCTGAGCCAATTCATGGAC,\n')
+    file = load_probes(str(probes))
+    assert file[['Gen-Position', 'Position']].values.tolist() == [['gyrA-261', 1], ['pncA-168', 1], ['pncA-168', 3],
+                                                                  ['pncA-168', 6]]
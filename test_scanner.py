@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from scanner import ProbeScanner
+
+
+def test_seed_prefix_of_another_seed():
+    scanner = ProbeScanner(['AAAACCCCGG', 'AAAACCCCGGTTTTAC'])
+    assert scanner.locate(b'AAAACCCCGATTTTAC') == {0: 10, 1: 16}
+    assert scanner.locate(b'TTAAAACCCCGG') == {0: 12}
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+from codons import CODON_CODES, CODONS
+from summary import CohortMatrix
+
+
+def write_matrix(directory: str, counts: np.ndarray) -> CohortMatrix:
+    """Write a two samples matrix of the three codon positions of rpoB-1305, whose reference codon CAG
+    is the one of position 1.
+
+    Args:
+        directory (str): Folder of the matrix.
+        counts (np.ndarray): Counts of each sample, locus, and codon.
+
+    Returns:
+        (CohortMatrix): Matrix of the folder.
+    """
+    meta = {'samples': ['s1', 's2'],
+            'Gen': ['rpoB'] * 3,
+            'Gen-Position': ['rpoB-1305'] * 3,
+            'Position': [1, 3, 9],
+            'Reference Codon': ['CAG'] * 3,
+            'Drug Resistance': ['Rifampin'] * 3}
+    with open(os.path.join(directory, 'matrix.json'), 'w') as handle:
+        json.dump(meta, handle)
+    np.save(os.path.join(directory, 'counts.npy'), counts)
+    return CohortMatrix(directory)
+
+
+def test_reference_codon_only_at_its_position(tmp_path):
+    counts = np.zeros((2, 3, len(CODONS)), dtype=np.uint32)
+    counts[:, 0, CODON_CODES['CAG']] = 100
+    counts[:, 1, CODON_CODES['GCT']] = 100
+    counts[:, 2, CODON_CODES['AAA']] = 100
+    counts[1, 0, CODON_CODES['CCG']] = 10
+    matrix = write_matrix(str(tmp_path), counts)
+
+    variants = matrix.minor_variants()
+    assert variants[['Sample', 'Position', 'Mutated Codon']].values.tolist() == [['s2', 1, 'CCG']]
+    summary = matrix.resistance_summary().set_index('Drug Resistance')
+    assert summary.loc['Rifampin'].tolist() == [1, 2, 0, 1]